@@ -0,0 +1,126 @@
+import argparse
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+from typing import List, Optional
+
+from change_sink import ChangeRecord
+
+
+class ChangeQuery:
+    """
+    Queries over the changes table written by ChangeSink. Every query is
+    answered from one of the table's indexes: by entity and time, by time, by
+    source type and time, or by season.
+    """
+
+    def __init__(self, path: str):
+        # Read-only, so a mistyped path fails instead of creating an empty
+        # database. The sink creates the table and its indexes.
+        self.db = sqlite3.connect(f"{Path(path).absolute().as_uri()}?mode=ro",
+                                  uri=True)
+
+    def changes(self, entity_id: Optional[str] = None,
+                start: Optional[str] = None, end: Optional[str] = None,
+                source_type: Optional[str] = None,
+                pipeline: Optional[str] = None) -> List[ChangeRecord]:
+        # start and end are ISO timestamps. Comparisons are textual, which is
+        # chronological as long as they're in the same form the sink writes.
+        conditions, params = [], []
+        for column, op, value in (('entity_id', '=', entity_id),
+                                  ('source_type', '=', source_type),
+                                  ('pipeline', '=', pipeline),
+                                  ('valid_from', '>=', start),
+                                  ('valid_from', '<=', end)):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.db.execute(f"SELECT * FROM changes {where} "
+                               f"ORDER BY valid_from", params)
+        return [ChangeRecord(*row) for row in rows]
+
+    def season_rollup(self, season: int, pipeline: Optional[str] = None) \
+            -> Counter:
+        query = "SELECT source_type, COUNT(*) FROM changes WHERE season = ?"
+        params = [season]
+        if pipeline is not None:
+            query += " AND pipeline = ?"
+            params.append(pipeline)
+        return Counter(dict(self.db.execute(query + " GROUP BY source_type",
+                                            params)))
+
+    def field_history(self, entity_id: str, field: str) -> List[ChangeRecord]:
+        # One player has at most a few thousand records, so filtering the
+        # entity's rows is cheaper than maintaining a separate key index
+        return [record for record in self.changes(entity_id=entity_id)
+                if field in record.keys_changed.split(",")]
+
+    def close(self):
+        self.db.close()
+
+
+def _print_records(records: List[ChangeRecord]):
+    for record in records:
+        where = ""
+        if record.game is not None:
+            where = f" (s{record.season} d{record.day} {record.game})"
+        print(f"{record.valid_from} {record.entity_id} {record.source_type} "
+              f"[{record.keys_changed}]{where}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query changes written by either pipeline")
+    parser.add_argument('--db', default="changes.sqlite")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    changes = commands.add_parser('changes',
+                                  help="What changed an entity, and why")
+    changes.add_argument('entity_id')
+    changes.add_argument('--start')
+    changes.add_argument('--end')
+    changes.add_argument('--source-type')
+
+    source_type = commands.add_parser('source-type',
+                                      help="All changes of one source type")
+    source_type.add_argument('source_type')
+    source_type.add_argument('--start')
+    source_type.add_argument('--end')
+
+    season = commands.add_parser('season',
+                                 help="Count of changes per source type")
+    season.add_argument('season', type=int)
+
+    field = commands.add_parser('field', help="History of one field")
+    field.add_argument('entity_id')
+    field.add_argument('field')
+
+    args = parser.parse_args()
+    try:
+        query = ChangeQuery(args.db)
+    except sqlite3.OperationalError as e:
+        parser.error(f"Can't open {args.db}: {e}")
+    start_time = perf_counter()
+
+    if args.command == 'changes':
+        _print_records(query.changes(entity_id=args.entity_id,
+                                     start=args.start, end=args.end,
+                                     source_type=args.source_type))
+    elif args.command == 'source-type':
+        _print_records(query.changes(source_type=args.source_type,
+                                     start=args.start, end=args.end))
+    elif args.command == 'season':
+        for source, count in query.season_rollup(args.season).most_common():
+            print(f"{count:8d} {source}")
+    elif args.command == 'field':
+        _print_records(query.field_history(args.entity_id, args.field))
+
+    print(f"({(perf_counter() - start_time) * 1000:.1f} ms)")
+    query.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+from dataclasses import dataclass, astuple
+from queue import Queue
+from typing import Iterable, List, Optional, Set
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    pipeline TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    valid_from TEXT NOT NULL,
+    source_type TEXT NOT NULL,
+    keys_changed TEXT NOT NULL,
+    season INTEGER,
+    day INTEGER,
+    game TEXT,
+    perceived_at TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_by_entity
+    ON changes (entity_id, valid_from);
+CREATE INDEX IF NOT EXISTS changes_by_time ON changes (valid_from);
+CREATE INDEX IF NOT EXISTS changes_by_source_type
+    ON changes (source_type, valid_from);
+CREATE INDEX IF NOT EXISTS changes_by_season ON changes (season, source_type);
+"""
+
+
+@dataclass
+class ChangeRecord:
+    # Which pipeline produced the record, 'v0' or 'v1'
+    pipeline: str
+    entity_id: str
+    # ISO 8601, so the column sorts chronologically
+    valid_from: str
+    source_type: str
+    # Comma-separated and sorted
+    keys_changed: str
+    season: Optional[int] = None
+    day: Optional[int] = None
+    game: Optional[str] = None
+    perceived_at: Optional[str] = None
+
+
+def join_keys(keys: Set[str]) -> str:
+    return ",".join(sorted(keys))
+
+
+class ChangeSink:
+    """
+    Writes ChangeRecords to an indexed SQLite table. Records are buffered and
+    handed to a writer thread in batches of `batch_size`, so the pipeline only
+    pays for appending to a list.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self._batch: List[tuple] = []
+        # Bounded so a slow disk applies backpressure instead of buffering the
+        # whole run in memory
+        self._queue: Queue = Queue(maxsize=4)
+        self._error: Optional[BaseException] = None
+
+        db = sqlite3.connect(path)
+        db.executescript(SCHEMA)
+        db.close()
+
+        self._writer = threading.Thread(target=self._write_batches,
+                                        name="change-sink", daemon=True)
+        self._writer.start()
+
+    def write(self, records: Iterable[ChangeRecord]):
+        self._batch.extend(astuple(record) for record in records)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._error is not None:
+            raise RuntimeError("Change sink writer failed") from self._error
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+
+    def sync(self):
+        # Blocks until everything written so far is committed
+        self.flush()
+        self._queue.join()
+        if self._error is not None:
+            raise RuntimeError("Change sink writer failed") from self._error
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        if self._error is not None:
+            raise RuntimeError("Change sink writer failed") from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_batches(self):
+        db = sqlite3.connect(self.path)
+        try:
+            while (batch := self._queue.get()) is not None:
+                if self._error is not None:
+                    # Drain the queue so producers don't block
+                    self._queue.task_done()
+                    continue
+                try:
+                    with db:
+                        db.executemany('INSERT INTO changes VALUES '
+                                       '(?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                except BaseException as e:
+                    self._error = e
+                self._queue.task_done()
+        finally:
+            db.close()
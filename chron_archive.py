@@ -0,0 +1,211 @@
+import hashlib
+import json
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator, Optional
+
+from timestamps import parse_timestamp
+
+ARCHIVE_PATH = "chron-archive.sqlite"
+# Versions written per transaction while a fetch is being archived
+COMMIT_EVERY = 1000
+COMPRESSION_LEVEL = 9
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+Fetch = Callable[[], Iterable[dict]]
+
+
+def _microseconds(time: datetime) -> int:
+    # Chronicler trims trailing zeros from the fraction, so its timestamp
+    # strings don't sort as text
+    delta = time - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + \
+        delta.microseconds
+
+
+def _document_hash(entry: dict) -> str:
+    # Chronicler's hash is of the data, which is what's stored under it
+    if entry.get('hash'):
+        return entry['hash']
+    return hashlib.sha256(json.dumps(entry['data'], sort_keys=True)
+                          .encode()).hexdigest()
+
+
+class ChronArchive:
+    """
+    Chronicler versions and entities kept in one SQLite file. Each version's
+    data is compressed and stored once under its hash, however many queries
+    returned it, with an index of versions by type, entity and time.
+
+    Queries are answered from the index once the archive has everything
+    they would return. Otherwise `fetch` is called, and what it returns is
+    passed through and archived on the way. A versions query counts as
+    covered once one from the same time or earlier has been read to the
+    end, and an entities query once one at exactly that time has. Like
+    requests_cache with no expiry, nothing newer is fetched after that.
+
+    The first document stored is kept as a zlib preset dictionary for the
+    rest. Player documents share most of their keys, so this shrinks each
+    one far more than compressing it alone.
+    """
+
+    def __init__(self, path: str = ARCHIVE_PATH,
+                 commit_every: int = COMMIT_EVERY):
+        self.path = path
+        self.commit_every = commit_every
+        self.db = sqlite3.connect(path)
+        self.closed = False
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS versions (
+                    type TEXT NOT NULL,
+                    entity_id TEXT NOT NULL,
+                    time INTEGER NOT NULL,
+                    valid_from TEXT NOT NULL,
+                    valid_to TEXT,
+                    hash TEXT NOT NULL,
+                    -- 0 if only an entities query has returned it
+                    listed INTEGER NOT NULL,
+                    PRIMARY KEY (type, entity_id, time)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS versions_by_time
+                    ON versions (type, time);
+                -- Earliest `after` a versions query has been read to the
+                -- end from, or NULL for from the start
+                CREATE TABLE IF NOT EXISTS version_coverage (
+                    type TEXT PRIMARY KEY,
+                    after INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS entity_snapshots (
+                    type TEXT NOT NULL,
+                    at INTEGER NOT NULL,
+                    PRIMARY KEY (type, at)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL
+                );
+            """)
+        row = self.db.execute("SELECT value FROM meta "
+                              "WHERE key = 'zdict'").fetchone()
+        self._zdict: Optional[bytes] = row[0] if row is not None else None
+
+    def versions(self, type_: str, after: Optional[datetime],
+                 fetch: Fetch) -> Iterator[dict]:
+        """
+        Versions of `type_` from after `after`, oldest first. Like
+        Chronicler's, `after` is exclusive.
+        """
+        after_us = _microseconds(after) if after is not None else None
+        row = self.db.execute("SELECT after FROM version_coverage "
+                              "WHERE type = ?", (type_,)).fetchone()
+        if row is not None and (row[0] is None or
+                                (after_us is not None and after_us >= row[0])):
+            yield from self._entries(
+                "SELECT entity_id, valid_from, valid_to, versions.hash, data "
+                "FROM versions JOIN documents USING (hash) "
+                "WHERE type = ? AND listed AND (? IS NULL OR time > ?) "
+                "ORDER BY time, entity_id", (type_, after_us, after_us))
+            return
+
+        yield from self._archive(type_, fetch(), listed=True)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO version_coverage "
+                            "VALUES (?, ?)", (type_, after_us))
+
+    def entities(self, type_: str, at: datetime,
+                 fetch: Fetch) -> Iterator[dict]:
+        """Every entity of `type_` as it was at `at`"""
+        at_us = _microseconds(at)
+        if self.db.execute("SELECT 1 FROM entity_snapshots "
+                           "WHERE type = ? AND at = ?",
+                           (type_, at_us)).fetchone() is not None:
+            yield from self._entries(
+                "SELECT entity_id, valid_from, valid_to, v.hash, data "
+                "FROM versions v JOIN documents USING (hash) "
+                "WHERE type = ? AND time = ("
+                "  SELECT MAX(time) FROM versions WHERE type = v.type "
+                "  AND entity_id = v.entity_id AND time <= ?) "
+                "ORDER BY entity_id", (type_, at_us))
+            return
+
+        yield from self._archive(type_, fetch(), listed=False)
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO entity_snapshots "
+                            "VALUES (?, ?)", (type_, at_us))
+
+    def close(self) -> None:
+        self.closed = True
+        self.db.close()
+
+    def _entries(self, query: str, params: tuple) -> Iterator[dict]:
+        for entity_id, valid_from, valid_to, hash_, data in \
+                self.db.execute(query, params):
+            yield {'entityId': entity_id, 'hash': hash_,
+                   'validFrom': valid_from, 'validTo': valid_to,
+                   'data': json.loads(self._decompress(data))}
+
+    def _archive(self, type_: str, entries: Iterable[dict],
+                 listed: bool) -> Iterator[dict]:
+        documents, versions = [], []
+        try:
+            for entry in entries:
+                hash_ = _document_hash(entry)
+                # Serialized now, since whoever the entry is passed on to may
+                # modify it
+                documents.append((hash_, json.dumps(
+                    entry['data'], separators=(',', ':')).encode()))
+                versions.append((type_, entry['entityId'],
+                                 _microseconds(parse_timestamp(
+                                     entry['validFrom'])),
+                                 entry['validFrom'], entry.get('validTo'),
+                                 hash_, listed))
+                if len(versions) >= self.commit_every:
+                    self._write(documents, versions)
+                    documents, versions = [], []
+                yield entry
+        finally:
+            # Also if the fetch fails or the caller stops early. What's
+            # archived is kept, but the query isn't covered until a fetch
+            # is read to the end. Unless the archive was closed under a
+            # query that was never finished, in which case it's dropped.
+            if not self.closed:
+                self._write(documents, versions)
+
+    def _write(self, documents: list, versions: list) -> None:
+        with self.db:
+            new = [(hash_, data) for hash_, data in documents
+                   if self.db.execute("SELECT 1 FROM documents WHERE hash = ?",
+                                      (hash_,)).fetchone() is None]
+            self.db.executemany(
+                "INSERT OR IGNORE INTO documents VALUES (?, ?)",
+                [(hash_, self._compress(data)) for hash_, data in new])
+            # A version first seen as the latest has no validTo yet
+            self.db.executemany(
+                "INSERT INTO versions VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (type, entity_id, time) DO UPDATE SET "
+                "valid_to = COALESCE(excluded.valid_to, valid_to), "
+                "listed = MAX(listed, excluded.listed)",
+                versions)
+
+    def _compress(self, data: bytes) -> bytes:
+        if self._zdict is None:
+            self._zdict = data
+            self.db.execute("INSERT INTO meta VALUES ('zdict', ?)", (data,))
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=self._zdict)
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, data: bytes) -> bytes:
+        decompressor = zlib.decompressobj(zdict=self._zdict)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+# Set by main to answer Chronicler queries that would otherwise be cached
+# forever by requests_cache
+archive: Optional[ChronArchive] = None
@@ -0,0 +1,43 @@
+from typing import Dict, List
+
+
+class IdInterner:
+    """
+    Numbers the entity, game and team UUIDs a run sees from 0 up, so the
+    indexes that are keyed on them can hold small ints instead of 36
+    character strings. Every index has to go through the same interner, so
+    there's one for the whole process, `ids`. Turn ids back into UUIDs with
+    `uuid` wherever they leave the process, like logs and output records.
+
+    Numbers are only meaningful for the interner that gave them out, so
+    anything that saves interned ids has to save the interner's `uuids`
+    alongside and `restore` them before interning anything else.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self.uuids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.uuids)
+
+    def intern(self, uuid: str) -> int:
+        interned = self._ids.get(uuid)
+        if interned is None:
+            interned = self._ids[uuid] = len(self.uuids)
+            self.uuids.append(uuid)
+        return interned
+
+    def uuid(self, interned: int) -> str:
+        return self.uuids[interned]
+
+    def restore(self, uuids: List[str]) -> None:
+        # Anything interned before the restore has to have been given the
+        # same number it was saved with
+        if self.uuids != uuids[:len(self.uuids)]:
+            raise RuntimeError("Ids were interned before restoring saved ids")
+        for uuid in uuids[len(self.uuids):]:
+            self.intern(uuid)
+
+
+ids = IdInterner()
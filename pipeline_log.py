@@ -0,0 +1,144 @@
+import json
+import logging
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from logging.handlers import MemoryHandler
+from time import monotonic
+from typing import Dict, Optional
+
+LOG_PATH = "pipeline-log.jsonl"
+LOG_LEVEL = 'WARNING'
+# Records are held in memory and written this many at a time, or right away
+# once one at ERROR or above comes in
+BUFFER_RECORDS = 10000
+
+# Attributes every LogRecord has. Anything else on a record came from
+# `extra` and goes into its JSON line as a field.
+_STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any `extra` fields alongside"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in _STANDARD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets through one in every `every` records of each message below
+    `below`. Records are told apart by their unformatted message, so each
+    kind of diagnostic is sampled on its own.
+    """
+
+    def __init__(self, every: int, below: int = logging.WARNING):
+        super().__init__()
+        self.every = every
+        self.below = below
+        self._counts: Dict[str, int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.below:
+            return True
+        count = self._counts[record.msg]
+        self._counts[record.msg] = count + 1
+        return count % self.every == 0
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `per_second` records of each message below
+    `below` every second. The first record let through after some were
+    dropped says how many in its `suppressed` field.
+    """
+
+    def __init__(self, per_second: int, below: int = logging.ERROR):
+        super().__init__()
+        self.per_second = per_second
+        self.below = below
+        # Message -> (start of its current second, records let through in
+        # it, records dropped since the last one let through)
+        self._windows: Dict[str, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.below:
+            return True
+        now = monotonic()
+        window = self._windows.get(record.msg)
+        if window is None or now - window[0] >= 1:
+            suppressed = window[2] if window is not None else 0
+            window = self._windows[record.msg] = [now, 0, suppressed]
+        if window[1] >= self.per_second:
+            window[2] += 1
+            return False
+        window[1] += 1
+        if window[2]:
+            record.suppressed = window[2]
+            window[2] = 0
+        return True
+
+
+def configure(path: str = LOG_PATH, level: str = LOG_LEVEL,
+              sample_every: int = 1,
+              rate_limit: Optional[int] = None) -> None:
+    """
+    Sends every logger's records at `level` and above to `path` as JSON
+    lines, through an in-memory buffer. Warnings and errors are also shown
+    on stderr. Loggers check their level before doing anything else, so
+    debug and info logging in the hot path is close to free while the level
+    is above them.
+    """
+    file_handler = logging.FileHandler(path, delay=True)
+    file_handler.setFormatter(JsonFormatter())
+    handler = MemoryHandler(BUFFER_RECORDS, flushLevel=logging.ERROR,
+                            target=file_handler)
+    if sample_every > 1:
+        handler.addFilter(SampleFilter(sample_every))
+    if rate_limit is not None:
+        handler.addFilter(RateLimitFilter(rate_limit))
+
+    console = logging.StreamHandler()
+    console.setLevel(logging.WARNING)
+    console.setFormatter(logging.Formatter("%(levelname)s %(name)s: "
+                                           "%(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    root.addHandler(console)
+
+
+def flush() -> None:
+    # For long runs that may be killed rather than exit, so what's buffered
+    # isn't lost
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument('--log-file', default=LOG_PATH)
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG logs every feed event and chron version, "
+                             "INFO every change found")
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help="Only log one in this many of each debug and "
+                             "info message")
+    parser.add_argument('--log-rate-limit', type=int,
+                        help="Most of each message below ERROR to log per "
+                             "second")
+
+
+def configure_from_args(args: Namespace) -> None:
+    configure(args.log_file, args.log_level, args.log_sample,
+              args.log_rate_limit)
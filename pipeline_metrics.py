@@ -0,0 +1,183 @@
+import json
+import os
+import resource
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from datetime import datetime, timezone
+from time import monotonic, time
+from typing import Callable, Dict, Optional
+
+# Seconds between writes
+METRICS_INTERVAL = 30
+
+
+def _resident_bytes() -> int:
+    # Current RSS where /proc has it, otherwise the peak from getrusage
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux, which is the only place it
+        # should get this far
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # Readers like the Prometheus textfile collector never see a half
+    # written file
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+class PipelineMetrics:
+    """
+    Throughput and lag for one pipeline run, written every `interval`
+    seconds to a Prometheus text format file and a JSON snapshot. Nothing
+    serves them; point a textfile collector at the .prom file, or read the
+    JSON from a batch job.
+
+    Callers report each item as it's processed with `observe`, which is
+    cheap enough for the hot path and only writes when the interval is up.
+    Values that are expensive to keep current, like pending changes, are
+    registered with `add_gauge` and only computed when writing. Call `write`
+    once more at the end of the run.
+    """
+
+    def __init__(self, pipeline: str, prom_path: Optional[str],
+                 json_path: Optional[str],
+                 interval: float = METRICS_INTERVAL):
+        self.pipeline = pipeline
+        self.prom_path = prom_path
+        self.json_path = json_path
+        self.interval = interval
+        self.items: Dict[str, int] = defaultdict(int)
+        # Time of the newest item seen from each source
+        self.latest: Dict[str, datetime] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._start = monotonic()
+        self._last_write = self._start
+        self._items_at_last_write: Dict[str, int] = {}
+        self._next_write = self._start + interval
+
+    def observe(self, source: str, timestamp: Optional[datetime] = None,
+                count: int = 1) -> None:
+        self.items[source] += count
+        if timestamp is not None:
+            latest = self.latest.get(source)
+            if latest is None or timestamp > latest:
+                self.latest[source] = timestamp
+        self.tick()
+
+    def tick(self) -> None:
+        # Writes if the interval is up. For callers that can go a while
+        # without observing anything, like a poll loop.
+        if monotonic() >= self._next_write:
+            self.write()
+
+    def add_gauge(self, name: str, value: Callable[[], float]) -> None:
+        self._gauges[name] = value
+
+    def watch_session(self, session) -> None:
+        # requests_cache runs response hooks for cached responses too, and
+        # marks them with from_cache
+        def count_response(response, *args, **kwargs):
+            if getattr(response, 'from_cache', False):
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+            return response
+
+        session.hooks['response'].append(count_response)
+
+    def snapshot(self) -> dict:
+        now = monotonic()
+        elapsed = now - self._last_write
+        wall_now = datetime.now(timezone.utc)
+        requests = self.cache_hits + self.cache_misses
+        return {
+            'pipeline': self.pipeline,
+            'time': time(),
+            'uptime_seconds': now - self._start,
+            'items_total': dict(self.items),
+            'items_per_second': {
+                source: (count - self._items_at_last_write.get(source, 0)) /
+                elapsed if elapsed > 0 else 0.
+                for source, count in self.items.items()},
+            'lag_seconds': {source: (wall_now - latest).total_seconds()
+                            for source, latest in self.latest.items()},
+            'cache_hits_total': self.cache_hits,
+            'cache_misses_total': self.cache_misses,
+            'cache_hit_ratio': self.cache_hits / requests if requests
+            else 0.,
+            'resident_memory_bytes': _resident_bytes(),
+            **{name: value() for name, value in self._gauges.items()},
+        }
+
+    def write(self) -> None:
+        snapshot = self.snapshot()
+        self._last_write = monotonic()
+        self._next_write = self._last_write + self.interval
+        self._items_at_last_write = dict(self.items)
+
+        if self.json_path is not None:
+            _write_atomic(self.json_path, json.dumps(snapshot, indent=2))
+        if self.prom_path is not None:
+            _write_atomic(self.prom_path, self._prometheus(snapshot))
+
+    def _prometheus(self, snapshot: dict) -> str:
+        lines = []
+        pipeline = f'pipeline="{self.pipeline}"'
+
+        def metric(name: str, kind: str, help_text: str, values):
+            lines.append(f"# HELP blaseball_{name} {help_text}")
+            lines.append(f"# TYPE blaseball_{name} {kind}")
+            if isinstance(values, dict):
+                for source, value in sorted(values.items()):
+                    lines.append(f'blaseball_{name}{{{pipeline},'
+                                 f'source="{source}"}} {value}')
+            else:
+                lines.append(f"blaseball_{name}{{{pipeline}}} {values}")
+
+        metric('items_total', 'counter', "Items read from each source",
+               snapshot['items_total'])
+        metric('items_per_second', 'gauge',
+               "Items read from each source per second since the last write",
+               snapshot['items_per_second'])
+        metric('lag_seconds', 'gauge',
+               "Wall clock time minus the time of the newest item from each "
+               "source", snapshot['lag_seconds'])
+        metric('cache_hits_total', 'counter',
+               "Responses served from the requests cache",
+               snapshot['cache_hits_total'])
+        metric('cache_misses_total', 'counter',
+               "Responses fetched from the server",
+               snapshot['cache_misses_total'])
+        metric('cache_hit_ratio', 'gauge',
+               "Share of responses served from the requests cache",
+               snapshot['cache_hit_ratio'])
+        metric('resident_memory_bytes', 'gauge', "Resident set size",
+               snapshot['resident_memory_bytes'])
+        for name in self._gauges:
+            metric(name, 'gauge', name.replace('_', ' ').capitalize(),
+                   snapshot[name])
+        return "\n".join(lines) + "\n"
+
+
+def add_arguments(parser: ArgumentParser, pipeline: str) -> None:
+    parser.add_argument('--metrics-prom', default=f"{pipeline}-metrics.prom",
+                        help="Prometheus text format file to write metrics "
+                             "to, or '' to not write one")
+    parser.add_argument('--metrics-json', default=f"{pipeline}-metrics.json",
+                        help="JSON file to write metrics to, or '' to not "
+                             "write one")
+    parser.add_argument('--metrics-interval', type=float,
+                        default=METRICS_INTERVAL,
+                        help="Seconds between metrics writes")
+
+
+def from_args(args: Namespace, pipeline: str) -> PipelineMetrics:
+    return PipelineMetrics(pipeline, args.metrics_prom or None,
+                           args.metrics_json or None, args.metrics_interval)
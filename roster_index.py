@@ -0,0 +1,202 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+ROSTERS_PATH = 'data/team_rosters.csv'
+
+# position_type_id of the lineup and rotation. The rest are the bullpen, the
+# bench and the shadows, who don't play.
+ACTIVE_POSITION_TYPES = (0, 1)
+
+# Times are stored as microseconds since the earliest roster entry, which
+# leaves room for the player's index above them in one int64 sort key
+_TIME_BITS = 48
+_NEVER = (1 << _TIME_BITS) - 1
+
+Timestamp = Union[str, datetime, pd.Timestamp]
+
+
+class RosterSpot(NamedTuple):
+    team_id: str
+    player_id: str
+    position_type_id: int
+    valid_from: pd.Timestamp
+    valid_until: Optional[pd.Timestamp]
+
+
+def _to_utc(times) -> pd.Series:
+    # Roster and event table times are naive UTC strings, v1 times are aware
+    # datetimes. to_datetime with utc=True reads both the same way.
+    return pd.to_datetime(pd.Series(times), utc=True, format='mixed')
+
+
+def _snapshots(intervals: Iterable[Tuple[int, int, int]]) \
+        -> Tuple[List[int], List[Tuple[int, ...]]]:
+    # Takes (start, end, spot) and returns every time the set of spots
+    # changes, with the set from then until the next change
+    changes = []
+    for start, end, spot in intervals:
+        changes.append((start, 1, spot))
+        if end != _NEVER:
+            changes.append((end, 0, spot))
+    changes.sort()
+
+    times, snapshots, current = [], [], set()
+    for time, added, spot in changes:
+        if added:
+            current.add(spot)
+        else:
+            current.discard(spot)
+        snapshot = tuple(sorted(current))
+        if times and times[-1] == time:
+            snapshots[-1] = snapshot
+        else:
+            times.append(time)
+            snapshots.append(snapshot)
+    return times, snapshots
+
+
+class RosterIndex:
+    """
+    Interval index over team_rosters.csv. Answers which team and position a
+    player was in at a time, and who was on a team at a time, each with one
+    binary search.
+
+    For every player and every team, the index keeps each time their roster
+    entries changed along with the entries in effect from then until the
+    next change. A player can briefly have more than one entry (moving
+    between teams, or shadows); the one that started last is their primary
+    entry. Player boundaries all live in one array sorted by (player, time),
+    which is what lets teams_at look up a whole column of events at once.
+    """
+
+    def __init__(self, rosters: pd.DataFrame):
+        rosters = rosters.reset_index(drop=True)
+        valid_from = _to_utc(rosters['valid_from'])
+        valid_until = _to_utc(rosters['valid_until'])
+        self._base = valid_from.min()
+        starts = self._micros(valid_from)
+        ends = self._micros(valid_until)
+
+        self._spots = [
+            RosterSpot(team_id, player_id, int(position_type_id), start,
+                       None if pd.isna(end) else end)
+            for team_id, player_id, position_type_id, start, end in zip(
+                rosters['team_id'], rosters['player_id'],
+                rosters['position_type_id'], valid_from, valid_until)]
+        self._team_ids = rosters['team_id'].to_numpy(object)
+        self._position_types = rosters['position_type_id'].to_numpy(np.int64)
+
+        intervals_by_team = defaultdict(list)
+        intervals_by_player = defaultdict(list)
+        for i, spot in enumerate(self._spots):
+            interval = (int(starts[i]), int(ends[i]), i)
+            intervals_by_team[spot.team_id].append(interval)
+            intervals_by_player[spot.player_id].append(interval)
+
+        self._team_times: Dict[str, List[int]] = {}
+        self._team_snapshots: Dict[str, List[Tuple[int, ...]]] = {}
+        for team_id, intervals in intervals_by_team.items():
+            self._team_times[team_id], self._team_snapshots[team_id] = \
+                _snapshots(intervals)
+
+        self._player_codes: Dict[str, int] = {}
+        keys, self._player_snapshots, primary = [], [], []
+        for code, (player_id, intervals) in \
+                enumerate(sorted(intervals_by_player.items())):
+            self._player_codes[player_id] = code
+            times, snapshots = _snapshots(intervals)
+            keys.extend((code << _TIME_BITS) | time for time in times)
+            self._player_snapshots.extend(snapshots)
+            primary.extend(max(snapshot, key=lambda i: starts[i])
+                           if snapshot else -1 for snapshot in snapshots)
+        self._keys = np.array(keys, dtype=np.int64)
+        self._key_codes = self._keys >> _TIME_BITS
+        self._primary = np.array(primary, dtype=np.int64)
+
+    @classmethod
+    def from_csv(cls, path: str = ROSTERS_PATH) -> 'RosterIndex':
+        return cls(pd.read_csv(path))
+
+    def _micros(self, times: pd.Series) -> np.ndarray:
+        micros = (times - self._base) // pd.Timedelta(microseconds=1)
+        return micros.fillna(_NEVER).clip(-1, _NEVER).to_numpy(np.int64)
+
+    def _micros_at(self, at: Timestamp) -> int:
+        # _micros for one time, without the overhead of building a Series
+        at = pd.Timestamp(at)
+        at = at.tz_localize('UTC') if at.tzinfo is None else at
+        micros = (at - self._base) // pd.Timedelta(microseconds=1)
+        return min(max(micros, -1), _NEVER)
+
+    def _player_boundary(self, player_id: str, at: Timestamp) -> int:
+        code = self._player_codes.get(player_id)
+        if code is None:
+            return -1
+        time = self._micros_at(at)
+        if time < 0:
+            return -1
+        i = int(np.searchsorted(self._keys, (code << _TIME_BITS) | time,
+                                side='right')) - 1
+        return i if i >= 0 and self._key_codes[i] == code else -1
+
+    def has_player(self, player_id: str) -> bool:
+        return player_id in self._player_codes
+
+    def team_at(self, player_id: str, at: Timestamp) -> Optional[RosterSpot]:
+        # The player's primary roster entry at `at`, if they had any
+        i = self._player_boundary(player_id, at)
+        if i < 0 or self._primary[i] < 0:
+            return None
+        return self._spots[self._primary[i]]
+
+    def spots_at(self, player_id: str, at: Timestamp) -> List[RosterSpot]:
+        # Every roster entry the player had at `at`
+        i = self._player_boundary(player_id, at)
+        if i < 0:
+            return []
+        return [self._spots[j] for j in self._player_snapshots[i]]
+
+    def roster_at(self, team_id: str, at: Timestamp,
+                  active_only: bool = True) -> List[RosterSpot]:
+        times = self._team_times.get(team_id)
+        if times is None:
+            return []
+        i = bisect_right(times, self._micros_at(at)) - 1
+        if i < 0:
+            return []
+        spots = [self._spots[j] for j in self._team_snapshots[team_id][i]]
+        if active_only:
+            spots = [spot for spot in spots
+                     if spot.position_type_id in ACTIVE_POSITION_TYPES]
+        return spots
+
+    def teams_at(self, player_ids, times) -> pd.DataFrame:
+        """
+        team_at for a whole column of events at once. Takes the player id and
+        time columns of an event table and returns team_id and
+        position_type_id columns with the same index, NaN where the player
+        wasn't on a roster.
+        """
+        index = player_ids.index if isinstance(player_ids, pd.Series) \
+            else None
+        codes = pd.Series(player_ids).map(self._player_codes) \
+            .fillna(-1).to_numpy(np.int64)
+        micros = self._micros(_to_utc(times))
+        keys = (np.maximum(codes, 0) << _TIME_BITS) | np.maximum(micros, 0)
+
+        i = np.searchsorted(self._keys, keys, side='right') - 1
+        primary = self._primary[np.maximum(i, 0)]
+        found = ((codes >= 0) & (micros >= 0) & (i >= 0) &
+                 (self._key_codes[np.maximum(i, 0)] == codes) & (primary >= 0))
+        primary = np.maximum(primary, 0)
+
+        return pd.DataFrame({
+            'team_id': np.where(found, self._team_ids[primary], None),
+            'position_type_id': np.where(found, self._position_types[primary],
+                                         np.nan),
+        }, index=index)
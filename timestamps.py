@@ -0,0 +1,34 @@
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from dateutil.parser import isoparse
+
+# Distinct strings to remember. Every version in a chron batch shares a
+# validFrom and a game tick's feed events share a created time, so repeats
+# are close together.
+CACHE_SIZE = 4096
+
+# Chronicler and Eventually both write UTC with a Z or +00:00. Chronicler
+# trims trailing zeros from the fraction, so it can have any number of
+# digits or be left off.
+_UTC_TIMESTAMP_RE = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)"
+                               r"(?:\.(\d+))?(?:Z|\+00:00)")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_timestamp(text: str) -> datetime:
+    """
+    Parses the timestamps Chronicler and Eventually return about three
+    times as fast as isoparse, and repeated ones much faster than that.
+    Anything else goes to isoparse. UTC times come back with timezone.utc
+    rather than isoparse's tzutc(), which compares and converts the same.
+    """
+    match = _UTC_TIMESTAMP_RE.fullmatch(text)
+    if match is None:
+        return isoparse(text)
+    year, month, day, hour, minute, second, fraction = match.groups()
+    return datetime(int(year), int(month), int(day), int(hour), int(minute),
+                    int(second),
+                    int(fraction[:6].ljust(6, '0')) if fraction else 0,
+                    tzinfo=timezone.utc)
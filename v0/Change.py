@@ -1,10 +1,10 @@
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Union, List, Optional
-
-from dateutil.parser import isoparse
+from typing import Dict, Union, List, Optional, Iterator
 
 from ChangeSource import ChangeSource
+from change_sink import ChangeRecord, join_keys
+from timestamps import parse_timestamp
 
 JsonDict = Dict[str, Union[float, int, str, list, dict]]
 
@@ -21,7 +21,23 @@ class Change:
     def __init__(self, before: Optional[JsonDict], after: JsonDict,
                  sources: List[ChangeSource]):
         self.player_id = after['entityId']
-        self.valid_from = isoparse(after['validFrom'])
+        self.valid_from = parse_timestamp(after['validFrom'])
         self.before = before['data'] if before is not None else None
         self.after = after['data']
         self.sources = sources
+
+    def to_records(self) -> Iterator[ChangeRecord]:
+        for source in self.sources:
+            season = getattr(source, 'season', None)
+            day = getattr(source, 'day', None)
+            yield ChangeRecord(
+                pipeline='v0',
+                entity_id=self.player_id,
+                valid_from=self.valid_from.isoformat(),
+                source_type=source.source_type.name,
+                keys_changed=join_keys(source.keys_changed),
+                # These can come from pandas rows, which sqlite can't bind
+                season=int(season) if season is not None else None,
+                day=int(day) if day is not None else None,
+                game=getattr(source, 'game', None),
+                perceived_at=getattr(source, 'perceived_at', None))
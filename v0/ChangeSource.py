@@ -209,19 +209,23 @@ class ChangeSourceType(Enum):
     WON_TOURNAMENT = auto()
 
 
+# Sources are made for every classification, so they're slotted to keep them
+# small. Each class lists only the fields it adds.
 @dataclass
 class ChangeSource:
+    __slots__ = ('source_type', 'keys_changed')
     source_type: ChangeSourceType
-    change: ChangeDescription
+    keys_changed: Set[str]
 
 
 @dataclass
 class UnknownTimeChangeSource(ChangeSource):
-    pass
+    __slots__ = ()
 
 
 @dataclass
 class GameEventChangeSource(ChangeSource):
+    __slots__ = ('season', 'day', 'game', 'perceived_at')
     season: int
     day: int
     game: str
@@ -230,15 +234,18 @@ class GameEventChangeSource(ChangeSource):
 
 @dataclass
 class GameEndChangeSource(ChangeSource):
+    __slots__ = ('season', 'day')
     season: int
     day: int
 
 
 @dataclass
 class ElectionChangeSource(ChangeSource):
+    __slots__ = ('season',)
     season: int
 
 
 @dataclass
 class EndseasonChangeSource(ChangeSource):
+    __slots__ = ('season',)
     season: int
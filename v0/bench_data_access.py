@@ -0,0 +1,214 @@
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from statistics import mean, quantiles
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+import find_changes as fc
+
+SEED = 0
+CALLS = 2000
+# Cold calls rebuild a whole table's index, so fewer of them
+COLD_CALLS = 50
+# Chron versions of one player are usually minutes to hours apart
+MAX_WINDOW = timedelta(hours=6)
+# Most get_events calls are for a player with no events in the table
+MISS_RATE = 0.8
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Every (table, id_column) that a finder passes to get_events
+GET_EVENTS_TABLES = [
+    ('discipline_incinerations', 'victim_id'),
+    ('discipline_incinerations', 'replacement_id'),
+    ('discipline_peanuts', 'player_id'),
+    ('discipline_blooddrains', 'drainer_id'),
+    ('discipline_blooddrains', 'drained_id'),
+    ('discipline_beans', 'player_id'),
+    ('discipline_parties', 'player_id'),
+    ('discipline_flame_eatings', 'player_id'),
+    ('discipline_magmatic_hits', 'player_id'),
+    ('discipline_unshellings', 'player_id'),
+    ('coffee_cup_coffee_beans', 'player_id'),
+    ('coffee_cup_percolations', 'player_id'),
+    ('coffee_cup_refill_gained', 'player_id'),
+    ('coffee_cup_refill_used', 'player_id'),
+    ('coffee_cup_gain_triple_threat', 'player_id'),
+    ('coffee_cup_lose_triple_threat', 'player_id'),
+]
+
+# A benchmark is a function that makes one call, given what the setup
+# function sampled for it
+Call = Callable[[tuple], object]
+
+
+def chron_time(timestamp: pd.Timestamp) -> str:
+    # A chron validFrom after get_events_from_record replaces the T
+    return timestamp.strftime(TIME_FORMAT)[:-3] + 'Z'
+
+
+def window(rng: random.Random, perceived_at: str) -> Tuple[str, str]:
+    # A before/after pair around an event, in the form the finders pass
+    at = pd.Timestamp(perceived_at)
+    return (chron_time(at - rng.uniform(0, 1) * MAX_WINDOW),
+            chron_time(at + rng.uniform(0, 1) * MAX_WINDOW))
+
+
+def sample_get_events(rng: random.Random, data: pd.DataFrame,
+                      id_column: str, all_player_ids: List[str]) -> tuple:
+    row = data.iloc[rng.randrange(len(data))]
+    before_time, after_time = window(rng, row['perceived_at'])
+    player_id = (rng.choice(all_player_ids) if rng.random() < MISS_RATE
+                 else row[id_column])
+    return player_id, before_time, after_time
+
+
+def get_events_benchmarks(rng: random.Random) \
+        -> Dict[str, Tuple[Call, List[tuple], bool]]:
+    all_player_ids = sorted(set(fc.team_rosters['player_id']))
+    benchmarks = {}
+    for table, id_column in GET_EVENTS_TABLES:
+        data = getattr(fc, table)
+        samples = [sample_get_events(rng, data, id_column, all_player_ids)
+                   for _ in range(CALLS)]
+
+        def call(args, data=data, id_column=id_column):
+            return fc.get_events(data, *args, id_column=id_column)
+
+        name = f"get_events({table}, {id_column})"
+        benchmarks[f"{name} cold"] = (call, samples[:COLD_CALLS], True)
+        benchmarks[f"{name} warm"] = (call, samples, False)
+
+    # The weekly mod finders scan every incineration and week end in the
+    # window
+    samples = [window(rng, perceived_at) for perceived_at in
+               rng.choices(list(fc.discipline_incinerations['perceived_at']),
+                           k=CALLS)]
+    benchmarks["get_events(discipline_incinerations, None)"] = (
+        lambda args: fc.get_events(fc.discipline_incinerations, None, *args,
+                                   id_column=None),
+        samples, False)
+
+    week_ends = fc.discipline_week_ends
+    samples = [window(rng, perceived_at) for perceived_at in
+               rng.choices(list(week_ends['perceived_at']), k=CALLS)]
+    benchmarks["get_events(discipline_week_ends, None)"] = (
+        lambda args: fc.get_events(week_ends, None, *args, id_column=None),
+        samples, False)
+    return benchmarks
+
+
+def query_benchmarks(rng: random.Random) \
+        -> Dict[str, Tuple[Call, List[tuple], bool]]:
+    benchmarks = {}
+
+    feedbacks = fc.discipline_feedbacks
+    samples = []
+    for _ in range(CALLS):
+        row = feedbacks.iloc[rng.randrange(len(feedbacks))]
+        player_id = row[rng.choice(['player_id', 'player_id_2'])]
+        samples.append((player_id, *window(rng, row['perceived_at'])))
+
+    def feedback_query(args):
+        # Same expression as find_discipline_feedback. query resolves @names
+        # from the calling frame, so they have to be locals.
+        player_id, before_time, after_time = args
+        return feedbacks.query(
+            '(player_id==@player_id or player_id_2==@player_id) and '
+            'perceived_at>=@before_time and perceived_at<=@after_time')
+
+    benchmarks["discipline_feedbacks.query"] = (feedback_query, samples, False)
+
+    mods = list(fc.modifications.index)
+    benchmarks["modifications.loc"] = (
+        lambda args: fc.modifications.loc[args[0], 'title'],
+        [(rng.choice(mods),) for _ in range(CALLS)], False)
+
+    # The string filters run on a player's get_events slice, so time them on
+    # slices of the size they actually see
+    beans = fc.discipline_beans
+    samples = []
+    for _ in range(CALLS):
+        row = beans.iloc[rng.randrange(len(beans))]
+        events = fc.get_events(beans, row['player_id'],
+                               *window(rng, row['perceived_at']))
+        samples.append((events, f"hits {row['player_name']} with chron "
+                                f"pitch! {row['player_name']} is now "
+                                f"Unstable!"))
+    benchmarks["str.contains literal (discipline_beans)"] = (
+        lambda args: args[0][args[0]['evt'].str.contains(args[1])],
+        samples, False)
+
+    coffee_beans = fc.coffee_cup_coffee_beans
+    samples = []
+    for _ in range(CALLS):
+        row = coffee_beans.iloc[rng.randrange(len(coffee_beans))]
+        events = fc.get_events(coffee_beans, row['player_id'],
+                               *window(rng, row['perceived_at']))
+        samples.append((events, rng.choice([" is no longer ", " is now Tired",
+                                            " is now Wired"])))
+    benchmarks["str.contains literal (coffee_cup_coffee_beans)"] = (
+        lambda args: args[0][args[0]['evt'].str.contains(args[1])],
+        samples, False)
+
+    incinerations = fc.discipline_incinerations
+    samples = []
+    for _ in range(CALLS):
+        row = incinerations.iloc[rng.randrange(len(incinerations))]
+        events = fc.get_events(incinerations, None,
+                               *window(rng, row['perceived_at']),
+                               id_column=None)
+        samples.append((events, r"The Instability (?:spreads|chains) to the "
+                                r"[\w ]+'s " + row['victim_name']))
+    benchmarks["str.contains regex (discipline_incinerations)"] = (
+        lambda args: args[0][args[0]['evt'].str.contains(args[1])],
+        samples, False)
+
+    return benchmarks
+
+
+def time_calls(call: Call, samples: List[tuple], cold: bool) -> List[float]:
+    latencies = []
+    for args in samples:
+        if cold:
+            fc.GET_EVENTS_CACHE.clear()
+        start = perf_counter()
+        call(args)
+        latencies.append((perf_counter() - start) * 1e6)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the data access patterns used by the v0 finders")
+    parser.add_argument('--output', default='bench_data_access.json')
+    args = parser.parse_args()
+
+    rng = random.Random(SEED)
+    benchmarks = {**get_events_benchmarks(rng), **query_benchmarks(rng)}
+
+    results = {'started': datetime.now().isoformat(), 'seed': SEED,
+               'benchmarks': {}}
+    print(f"{'calls':>6} {'mean us':>9} {'p50 us':>9} {'p99 us':>9}  pattern")
+    for name, (call, samples, cold) in benchmarks.items():
+        # Start every warm benchmark with the same, fully built cache
+        fc.GET_EVENTS_CACHE.clear()
+        if not cold:
+            call(samples[0])
+        latencies = time_calls(call, samples, cold)
+        percentiles = quantiles(latencies, n=100)
+        result = {'calls': len(latencies), 'mean_us': mean(latencies),
+                  'p50_us': percentiles[49], 'p99_us': percentiles[98]}
+        results['benchmarks'][name] = result
+        print(f"{result['calls']:>6} {result['mean_us']:>9.1f} "
+              f"{result['p50_us']:>9.1f} {result['p99_us']:>9.1f}  {name}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
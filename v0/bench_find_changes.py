@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import random
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from dateutil.parser import isoparse
+
+SEED = 0
+BASE_PLAYERS_PATH = 'data/oldest_entry_for_each_player.json'
+TRACKER_NOISE_VERSIONS = 20000
+TRACKER_NOISE_PLAYERS = 500
+# A few rows of the discipline tables are from the feed era, where their
+# versions would go to find_from_feed and the network
+DISCIPLINE_END = '2020-11-01'
+
+# A mutation is applied to a copy of the player's latest data to produce their
+# next version
+Mutation = Callable[[random.Random, dict], None]
+
+
+def chron_time(timestamp: datetime) -> str:
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def bump_attrs(attrs):
+    def mutate(rng: random.Random, data: dict):
+        for attr in attrs:
+            if isinstance(data.get(attr), (int, float)) and \
+                    not isinstance(data[attr], bool):
+                data[attr] += rng.uniform(0.01, 0.05)
+
+    return mutate
+
+
+def set_value(key, value):
+    def mutate(_: random.Random, data: dict):
+        data[key] = deepcopy(value)
+
+    return mutate
+
+
+def add_mod(attribute, mod):
+    def mutate(_: random.Random, data: dict):
+        if mod not in data[attribute]:
+            data[attribute].append(mod)
+
+    return mutate
+
+
+def remove_mod(attribute, mod):
+    def mutate(_: random.Random, data: dict):
+        if mod in data[attribute]:
+            data[attribute].remove(mod)
+
+    return mutate
+
+
+def hit_tracker(rng: random.Random, data: dict):
+    if rng.random() < 0.3:
+        data['consecutiveHits'] += 1
+        data['hitStreak'] = max(data['hitStreak'], data['consecutiveHits'])
+    else:
+        data['consecutiveHits'] = 0
+
+
+def precision_jitter(rng: random.Random, data: dict):
+    # Small enough for find_precision_changed to call it the same value
+    attr = rng.choice(['buoyancy', 'moxie', 'divinity', 'coldness'])
+    data[attr] += 1e-12
+
+
+class VersionGenerator:
+    """
+    Deterministic stream of chron player versions. Every player starts from
+    their oldest recorded entry, re-dated to the start of Chronicler so
+    find_chron_start accounts for it, and then changes once per mutation.
+    Versions come out in validFrom order with validTo filled in, like the
+    real versions endpoint.
+    """
+
+    def __init__(self, seed: int = SEED):
+        self.rng = random.Random(seed)
+        with open(BASE_PLAYERS_PATH) as f:
+            self.base = {entry['entityId']: entry for entry in json.load(f)}
+        self.templates = list(self.base.values())
+        self.mutations: List[Tuple[str, str, Mutation]] = []
+
+    def mutate(self, player_id: str, at: datetime, mutation: Mutation,
+               lag: Tuple[int, int] = (30, 120)):
+        # Chron records a change some time after the game event caused it
+        valid_from = at + timedelta(seconds=self.rng.uniform(*lag))
+        self.mutations.append((chron_time(valid_from), player_id, mutation))
+
+    def mutate_from_events(self, events: pd.DataFrame, mutation: Mutation,
+                           id_column: str = 'player_id',
+                           until: Optional[str] = None):
+        if until is not None:
+            events = events[events['perceived_at'] < until]
+        for _, event in events.iterrows():
+            self.mutate(event[id_column], isoparse(event['perceived_at']),
+                        mutation)
+
+    def versions(self) -> Iterator[dict]:
+        from find_changes import CHRON_START_DATE
+
+        latest: Dict[str, dict] = {}
+        versions = []
+        for player_id in sorted({player_id for _, player_id, _
+                                 in self.mutations}):
+            entry = deepcopy(self.base.get(player_id) or
+                             self.rng.choice(self.templates))
+            entry['entityId'] = player_id
+            entry['hash'] = f"{self.rng.getrandbits(128):032x}"
+            entry['validFrom'] = CHRON_START_DATE + '.438Z'
+            for attribute in ('permAttr', 'seasAttr', 'weekAttr', 'gameAttr'):
+                entry['data'].setdefault(attribute, [])
+            entry['data'].setdefault('consecutiveHits', 0)
+            entry['data'].setdefault('hitStreak', 0)
+            latest[player_id] = entry
+            versions.append(entry)
+
+        for valid_from, player_id, mutation in sorted(self.mutations,
+                                                      key=lambda m: m[:2]):
+            previous = latest[player_id]
+            data = deepcopy(previous['data'])
+            mutation(self.rng, data)
+            entry = {'entityId': player_id,
+                     'hash': f"{self.rng.getrandbits(128):032x}",
+                     'validFrom': valid_from, 'validTo': None, 'data': data}
+            previous['validTo'] = valid_from
+            latest[player_id] = entry
+            versions.append(entry)
+
+        for entry in latest.values():
+            entry['validTo'] = '2099-01-01T00:00:00.000Z'
+        versions.sort(key=lambda v: v['validFrom'])
+        return iter(versions)
+
+
+def discipline_era(generator: VersionGenerator):
+    import find_changes as fc
+
+    generator.mutate_from_events(fc.discipline_parties,
+                                 bump_attrs(fc.PARTY_ATTRS))
+    generator.mutate_from_events(fc.discipline_peanuts,
+                                 bump_attrs(fc.PEANUT_ATTRS),
+                                 until=DISCIPLINE_END)
+    for ability, attrs in (('hitting', fc.BLOODDRAIN_HITTING_ATTR),
+                           ('baserunning', fc.BLOODDRAIN_BASERUNNING_ATTR),
+                           ('pitching', fc.BLOODDRAIN_PITCHING_ATTR),
+                           ('defensive', fc.BLOODDRAIN_DEFENSE_ATTR)):
+        drains = fc.discipline_blooddrains
+        generator.mutate_from_events(
+            drains[drains['evt'].str.contains(f"{ability} ability")],
+            bump_attrs(attrs), id_column='drained_id')
+    generator.mutate_from_events(fc.discipline_feedbacks, bump_attrs({'fate'}))
+    generator.mutate_from_events(fc.discipline_flame_eatings,
+                                 add_mod('permAttr', 'MAGMATIC'))
+    generator.mutate_from_events(fc.discipline_magmatic_hits,
+                                 remove_mod('permAttr', 'MAGMATIC'))
+
+
+def coffee_cup(generator: VersionGenerator):
+    import find_changes as fc
+
+    beans = fc.coffee_cup_coffee_beans
+    for expected, game_attr in ((" is now Wired", ['WIRED']),
+                                (" is now Tired", ['TIRED']),
+                                (" is no longer ", [])):
+        generator.mutate_from_events(beans[beans['evt'].str.contains(expected)],
+                                     set_value('gameAttr', game_attr))
+    generator.mutate_from_events(fc.coffee_cup_percolations,
+                                 add_mod('permAttr', 'COFFEE_EXIT'))
+    generator.mutate_from_events(fc.coffee_cup_refill_gained,
+                                 add_mod('permAttr', 'COFFEE_RALLY'))
+    generator.mutate_from_events(fc.coffee_cup_refill_used,
+                                 remove_mod('permAttr', 'COFFEE_RALLY'))
+    generator.mutate_from_events(fc.coffee_cup_gain_triple_threat,
+                                 add_mod('permAttr', 'TRIPLE_THREAT'))
+    generator.mutate_from_events(fc.coffee_cup_lose_triple_threat,
+                                 remove_mod('permAttr', 'TRIPLE_THREAT'))
+
+
+def tracker_noise(generator: VersionGenerator):
+    # Hit trackers and float noise in the feed era. All of these are accounted
+    # for before find_from_feed runs, so this never touches the network.
+    from find_changes import FEED_START_DATE
+
+    player_ids = generator.rng.sample(sorted(generator.base.keys()),
+                                      TRACKER_NOISE_PLAYERS)
+    timestamp = isoparse(FEED_START_DATE)
+    for _ in range(TRACKER_NOISE_VERSIONS):
+        timestamp += timedelta(seconds=generator.rng.uniform(0, 2))
+        mutation = (precision_jitter if generator.rng.random() < 0.1
+                    else hit_tracker)
+        generator.mutate(generator.rng.choice(player_ids), timestamp, mutation)
+
+
+SCENARIOS = {
+    'discipline': discipline_era,
+    'coffee_cup': coffee_cup,
+    'tracker_noise': tracker_noise,
+}
+
+
+def run_scenario(name: str) -> dict:
+    # Runs in a fresh process, so the module-level state in find_changes
+    # (prev_for_player, GET_EVENTS_CACHE, ...) starts empty and peak RSS is
+    # this scenario's alone. Point any stray request at a closed port so the
+    # benchmark fails instead of silently going online.
+    os.environ['HTTP_PROXY'] = os.environ['HTTPS_PROXY'] = 'http://127.0.0.1:9'
+
+    import find_changes
+    from finder_stats import FinderStats
+
+    generator = VersionGenerator()
+    SCENARIOS[name](generator)
+    versions = list(generator.versions())
+
+    stats = find_changes.finder_stats = FinderStats(report_every=0)
+    start = perf_counter()
+    for version in versions:
+        find_changes.get_change(version)
+        stats.version_done()
+    seconds = perf_counter() - start
+
+    return {
+        'versions': len(versions),
+        'seconds': seconds,
+        'versions_per_second': len(versions) / seconds,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        **stats.as_dict(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark get_change on synthetic chron versions")
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS),
+                        help=f"Any of {', '.join(SCENARIOS)}")
+    parser.add_argument('--output', default='bench_find_changes.json')
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario {name}")
+
+    results = {'started': datetime.now().isoformat(), 'seed': SEED,
+               'scenarios': {}}
+    for name in args.scenarios:
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=get_context('spawn')) as pool:
+            result = pool.submit(run_scenario, name).result()
+        results['scenarios'][name] = result
+
+        print(f"{name}: {result['versions']} versions, "
+              f"{result['versions_per_second']:.0f}/s, "
+              f"peak RSS {result['peak_rss_kb'] / 1024:.0f} MiB")
+        ranked = sorted(result['finders'].items(),
+                        key=lambda item: -item[1]['seconds'])
+        for finder, counters in ranked[:5]:
+            print(f"  {counters['seconds']:8.3f}s {finder}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import hashlib
+import pickle
+import sqlite3
+import sys
+from functools import partial
+from types import CodeType, FunctionType
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+import pandas as pd
+
+from Change import JsonDict
+from ChangeSource import ChangeSource
+
+ChangeFinder = Callable[[Optional[JsonDict], JsonDict, Set[str]],
+                        Iterator[ChangeSource]]
+
+# Finders that read or write these module-level globals depend on more than
+# (before, after, changed_keys), so their output can't be replayed and they
+# are always re-evaluated
+STATEFUL_GLOBALS = {'delayed_updates', 'creeping_peanut', 'missing_beans',
+                    'prev_for_player'}
+
+# Caches that are filled in as the run goes, so they mustn't contribute to a
+# finder's fingerprint
+CACHE_GLOBALS = {'GET_EVENTS_CACHE'}
+
+
+def _module_fingerprint(module_name: str) -> str:
+    with open(sys.modules[module_name].__file__, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Outputs are stored as pickled ChangeSources, which only load back right
+# into the class definitions they were made with
+SOURCES_FINGERPRINT = _module_fingerprint(ChangeSource.__module__)
+
+
+class ChangeMemo:
+    """
+    Persistent memo of change finder outputs, keyed by the before and after
+    versions, the finder's identity, a fingerprint of the finder's code and
+    input tables, and the keys still unaccounted for when the finder ran. When
+    a finder or one of the tables it reads is edited its fingerprint changes,
+    so only that finder is re-evaluated on the next run. Editing ChangeSource
+    changes every finder's, since the stored sources are pickles of it.
+
+    A version is its chron hash and its validFrom and validTo. Hashes are of
+    the data alone and repeat whenever a player changes back, and the
+    finders that search the event tables look between those times.
+    """
+
+    def __init__(self, path: str, commit_every: int = 1000):
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS finder_outputs (
+                before_hash TEXT NOT NULL,
+                before_valid_from TEXT NOT NULL,
+                before_valid_to TEXT NOT NULL,
+                after_hash TEXT NOT NULL,
+                after_valid_from TEXT NOT NULL,
+                after_valid_to TEXT NOT NULL,
+                finder TEXT NOT NULL,
+                version TEXT NOT NULL,
+                pending TEXT NOT NULL,
+                output BLOB NOT NULL,
+                PRIMARY KEY (before_hash, before_valid_from, before_valid_to,
+                             after_hash, after_valid_from, after_valid_to,
+                             finder, version, pending)
+            )
+        """)
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        # finder -> (name, version), or None if the finder is stateful
+        self._identities: Dict[ChangeFinder, Optional[tuple]] = {}
+        self._fingerprints: Dict[int, str] = {}
+
+    def find(self, change_finder: ChangeFinder, before: Optional[JsonDict],
+             after: JsonDict, changed_keys: Set[str]) -> Iterator[ChangeSource]:
+        identity = self._identity(change_finder)
+        if identity is None or 'hash' not in after:
+            yield from change_finder(before, after, changed_keys)
+            return
+
+        name, version = identity
+        key = (*_version_key(before), *_version_key(after),
+               name, version, '\x1f'.join(sorted(changed_keys)))
+        row = self.db.execute(
+            'SELECT output FROM finder_outputs WHERE before_hash=? AND '
+            'before_valid_from=? AND before_valid_to=? AND after_hash=? AND '
+            'after_valid_from=? AND after_valid_to=? AND finder=? AND '
+            'version=? AND pending=?', key).fetchone()
+
+        if row is not None:
+            self.hits += 1
+            sources, consumed_keys = pickle.loads(row[0])
+            changed_keys.difference_update(consumed_keys)
+            yield from sources
+            return
+
+        self.misses += 1
+        keys_before = set(changed_keys)
+        sources: List[ChangeSource] = []
+        for source in change_finder(before, after, changed_keys):
+            sources.append(source)
+            yield source
+
+        # Only reached if the consumer exhausted the finder, so the stored
+        # output is always complete
+        output = pickle.dumps((sources, keys_before - changed_keys))
+        self.db.execute('INSERT OR REPLACE INTO finder_outputs '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (*key, output))
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self._uncommitted = 0
+
+    def prune(self):
+        # Drop outputs from finder versions that weren't used in this run
+        for name, version in filter(None, self._identities.values()):
+            self.db.execute('DELETE FROM finder_outputs '
+                            'WHERE finder=? AND version!=?', (name, version))
+        self.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def _identity(self, change_finder: ChangeFinder) -> Optional[tuple]:
+        try:
+            return self._identities[change_finder]
+        except KeyError:
+            pass
+
+        if _reads_state(change_finder, set()):
+            identity = None
+        else:
+            fingerprint = self._fingerprint(change_finder, set())
+            identity = (_finder_name(change_finder), hashlib.sha1(
+                (fingerprint + SOURCES_FINGERPRINT).encode()).hexdigest())
+        self._identities[change_finder] = identity
+        return identity
+
+    def _fingerprint(self, obj, visited: Set[int]) -> str:
+        h = hashlib.sha1()
+
+        if isinstance(obj, pd.DataFrame):
+            # Hashing a table is expensive, and the tables don't change within
+            # a run, so this is cached by identity
+            if id(obj) not in self._fingerprints:
+                values = pd.util.hash_pandas_object(obj, index=True).values
+                self._fingerprints[id(obj)] = \
+                    hashlib.sha1(values.tobytes()).hexdigest()
+            return self._fingerprints[id(obj)]
+        elif isinstance(obj, partial):
+            h.update(self._fingerprint(obj.func, visited).encode())
+            for arg in obj.args:
+                h.update(self._fingerprint(arg, visited).encode())
+            for name, arg in sorted(obj.keywords.items()):
+                h.update(name.encode())
+                h.update(self._fingerprint(arg, visited).encode())
+        elif isinstance(obj, FunctionType):
+            if id(obj) in visited:
+                return obj.__qualname__
+            visited.add(id(obj))
+            h.update(_code_fingerprint(obj.__code__).encode())
+            # Include module-level helpers, tables and constants the finder
+            # reads, so editing any of them invalidates the memo
+            for name in sorted(_referenced_globals(obj) - CACHE_GLOBALS):
+                value = obj.__globals__.get(name)
+                if isinstance(value, (FunctionType, partial, pd.DataFrame,
+                                      dict, list, tuple, set, frozenset, str,
+                                      int, float)):
+                    h.update(name.encode())
+                    h.update(self._fingerprint(value, visited).encode())
+        elif isinstance(obj, dict):
+            for k, v in sorted(obj.items(), key=lambda item: repr(item[0])):
+                h.update(repr(k).encode())
+                h.update(self._fingerprint(v, visited).encode())
+        elif isinstance(obj, (set, frozenset)):
+            for item in sorted(self._fingerprint(v, visited) for v in obj):
+                h.update(item.encode())
+        elif isinstance(obj, (list, tuple)):
+            for item in obj:
+                h.update(self._fingerprint(item, visited).encode())
+        else:
+            h.update(repr(obj).encode())
+
+        return h.hexdigest()
+
+
+def _version_key(version: Optional[JsonDict]) -> tuple:
+    # validTo is missing or None for a player's latest version
+    if version is None:
+        return '', '', ''
+    return (version['hash'], version.get('validFrom') or '',
+            version.get('validTo') or '')
+
+
+def _finder_name(change_finder: ChangeFinder) -> str:
+    if isinstance(change_finder, partial):
+        # Partials of the same function are distinguished by their arguments'
+        # reprs, which is stable for the enums that are used to tell them apart
+        args = ', '.join(repr(arg) for arg in change_finder.args
+                         if not isinstance(arg, (pd.DataFrame, set)))
+        return f"{_finder_name(change_finder.func)}({args})"
+    return f"{change_finder.__module__}.{change_finder.__qualname__}"
+
+
+def _reads_state(obj, visited: Set[int]) -> bool:
+    # Whether the finder, or any function it calls by global name or is
+    # partially applied to, touches one of the STATEFUL_GLOBALS
+    if isinstance(obj, partial):
+        return any(_reads_state(item, visited) for item in
+                   (obj.func, *obj.args, *obj.keywords.values()))
+    if not isinstance(obj, FunctionType) or id(obj) in visited:
+        return False
+    visited.add(id(obj))
+    names = _referenced_globals(obj)
+    if names & STATEFUL_GLOBALS:
+        return True
+    return any(_reads_state(obj.__globals__.get(name), visited)
+               for name in names)
+
+
+def _referenced_globals(func: FunctionType) -> Set[str]:
+    names = set()
+    stack = [func.__code__]
+    while stack:
+        code = stack.pop()
+        names.update(code.co_names)
+        stack.extend(c for c in code.co_consts if isinstance(c, CodeType))
+    return names
+
+
+def _code_fingerprint(code: CodeType) -> str:
+    h = hashlib.sha1(code.co_code)
+    for const in code.co_consts:
+        h.update(_const_fingerprint(const).encode())
+    h.update(repr(code.co_names).encode())
+    return h.hexdigest()
+
+
+def _const_fingerprint(const) -> str:
+    if isinstance(const, CodeType):
+        return _code_fingerprint(const)
+    elif isinstance(const, frozenset):
+        # Set literals compile to frozensets, whose repr order depends on the
+        # (randomized) string hash
+        return repr(sorted(_const_fingerprint(c) for c in const))
+    elif isinstance(const, tuple):
+        return repr(tuple(_const_fingerprint(c) for c in const))
+    return repr(const)
@@ -1,18 +1,23 @@
+import logging
 import re
 from collections import defaultdict
 from dataclasses import dataclass, field
 from datetime import timedelta, datetime
 from enum import Enum
 from functools import partial
+from time import perf_counter
 from typing import List, Optional, Set, Iterator
 
 import pandas as pd
 import requests_cache
 from blaseball_mike.eventually import search as feed_search
 from blaseball_mike.session import _SESSIONS_BY_EXPIRY
-from dateutil.parser import isoparse
 
 from Change import Change, JsonDict
+from change_memo import ChangeMemo
+from finder_stats import FinderStats
+from pipeline_metrics import PipelineMetrics
+from timestamps import parse_timestamp
 from ChangeSource import ChangeSource, ChangeSourceType, \
     UnknownTimeChangeSource, GameEventChangeSource, ElectionChangeSource, \
     EndseasonChangeSource, GameEndChangeSource
@@ -20,6 +25,8 @@ from ChangeSource import ChangeSource, ChangeSourceType, \
 # CHRON_START_DATE = '2020-09-13T19:20:00Z'
 from find_feed_changes import FEED_CHANGE_FINDERS
 
+log = logging.getLogger(__name__)
+
 CHRON_START_DATE = '2020-07-29T08:12:22'
 FEED_START_DATE = '2021-03-01T03:37:36+00:00'
 
@@ -135,6 +142,13 @@ coffee_cup_lose_triple_threat = \
 
 GET_EVENTS_CACHE = {}
 
+# Set by main to replay finder outputs from previous runs
+change_memo: Optional[ChangeMemo] = None
+# Set by main to collect per-finder timing
+finder_stats: Optional[FinderStats] = None
+# Set by main to count feed events read
+metrics: Optional[PipelineMetrics] = None
+
 SIPHON_BLOODDRAIN_RE = re.compile(r"ability to (?:add|remove) chron")
 
 DAY_X_FEEDBACKS = {
@@ -157,30 +171,25 @@ DAY_X_FEEDBACKS = {
 }
 
 
-def get_change_description(before: Optional[dict], after: dict) \
-        -> ChangeDescription:
+def get_changed_keys(before: Optional[dict], after: dict) -> Set[str]:
+    """
+    Top-level keys the finders have to account for. A mod attribute only
+    counts if its set of mods changed, not just their order.
+    """
     if before is None:
-        return ChangeDescription(new_player=True)
-
-    before_keys = set(before['data'].keys())
-    after_keys = set(after['data'].keys())
+        return set(after['data'].keys())
 
-    change = ChangeDescription()
-    change.attributes_added = after_keys - before_keys
-    change.attributes_removed = before_keys - after_keys
-    change.attributes_changed = {key for key in before_keys.union(after_keys)
-                                 if before['data'][key] != after['data'][key]
-                                 and key not in MOD_ATTRIBUTES}
+    before_data = before['data']
+    after_data = after['data']
+    changed_keys = before_data.keys() ^ after_data.keys()
+    for key in before_data.keys() & after_data.keys():
+        if key in MOD_ATTRIBUTES:
+            if set(before_data[key]) != set(after_data[key]):
+                changed_keys.add(key)
+        elif before_data[key] != after_data[key]:
+            changed_keys.add(key)
 
-    for mod_duration in MOD_ATTRIBUTES:
-        mods_before = set(before['data'][mod_duration])
-        mods_after = set(after['data'][mod_duration])
-        change.mods_added.update({Mod(name, ModDuration(mod_duration))
-                                  for name in mods_after - mods_before})
-        change.mods_removed.update({Mod(name, ModDuration(mod_duration))
-                                    for name in mods_before - mods_after})
-
-    return change
+    return changed_keys
 
 
 def get_change(after):
@@ -188,10 +197,33 @@ def get_change(after):
     prev_for_player[after['entityId']] = after
 
     sources: List[ChangeSource] = []
-    pending_changes = get_change_description(before, after)
+    diff_start = perf_counter()
+    pending_changes = get_changed_keys(before, after)
+    finders_start = perf_counter()
 
+    try:
+        return _find_sources(before, after, pending_changes, sources)
+    finally:
+        if finder_stats is not None:
+            finder_stats.add_stage_time('diff', finders_start - diff_start)
+            finder_stats.add_stage_time('finders',
+                                        perf_counter() - finders_start)
+
+
+def _find_sources(before: Optional[JsonDict], after: JsonDict,
+                  pending_changes: Set[str], sources: List[ChangeSource]) \
+        -> Change:
     for change_finder in CHANGE_FINDERS:
-        for source in change_finder(before, after, pending_changes):
+        if change_memo is None:
+            found = change_finder(before, after, pending_changes)
+        else:
+            found = change_memo.find(change_finder, before, after,
+                                     pending_changes)
+        if finder_stats is not None:
+            found = finder_stats.time_finder(change_finder, found,
+                                             pending_changes)
+
+        for source in found:
             # Source should be derived from ChangeSource but not the base duration
             assert isinstance(source, ChangeSource)
             assert not type(source) is ChangeSource
@@ -205,7 +237,8 @@ def get_change(after):
             return Change(before, after, sources)
 
     return Change(before, after, [
-        UnknownTimeChangeSource(ChangeSourceType.UNKNOWN, pending_changes)
+        UnknownTimeChangeSource(ChangeSourceType.UNKNOWN,
+                                keys_changed=pending_changes)
     ])
     raise RuntimeError("Can't identify change")
 
@@ -593,11 +626,11 @@ def find_creeping_peanuts(before: Optional[JsonDict], after: JsonDict,
                 ChangeSourceType.CREEPING_PEANUT_ALLERGY, {'peanutAllergy'})
         else:
             if not after['entityId'] in creeping_peanut:
-                print(after['data']['name'],
-                      "was un-allergized without being made allergic")
+                log.warning("%s was un-allergized without being made "
+                            "allergic", after['data']['name'])
             elif not creeping_peanut[after['entityId']]:
-                print(after['data']['name'],
-                      "was un-allergized twice")
+                log.warning("%s was un-allergized twice",
+                            after['data']['name'])
             creeping_peanut[after['entityId']] = False
             yield UnknownTimeChangeSource(
                 ChangeSourceType.CREEPING_PEANUT_ALLERGY_REMOVED,
@@ -647,13 +680,15 @@ def find_from_feed(before: JsonDict, after: JsonDict,
     if after['validFrom'] < FEED_START_DATE:
         return
 
-    timestamp = isoparse(after['validFrom'])
+    timestamp = parse_timestamp(after['validFrom'])
     events = feed_search(cache_time=None, limit=-1, query={
         'playerTags': after['entityId'],
         'before': after['validFrom'],
         'after': time_str(timestamp - timedelta(seconds=180)),
     })
     for event in events:
+        if metrics is not None:
+            metrics.observe('feed_events')
         yield from FEED_CHANGE_FINDERS[event['duration']](event, before, after,
                                                       changed_keys)
 
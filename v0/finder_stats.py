@@ -0,0 +1,127 @@
+import json
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from enum import Enum
+from functools import partial
+from time import perf_counter
+from typing import Dict, Iterator, Iterable, Set, TypeVar
+
+from ChangeSource import ChangeSource
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+STAGES = ('fetch', 'diff', 'finders', 'output')
+
+
+@dataclass
+class FinderCounters:
+    invocations: int = 0
+    seconds: float = 0
+    sources: int = 0
+    keys_consumed: int = 0
+
+
+class FinderStats:
+    """
+    Per-finder and per-stage timing for the v0 pipeline. Everything is
+    plain attribute arithmetic around perf_counter, so it's cheap enough to
+    leave on for full runs.
+    """
+
+    def __init__(self, report_every: int = 10000):
+        self.report_every = report_every
+        self.versions = 0
+        self.finders: Dict[str, FinderCounters] = defaultdict(FinderCounters)
+        self.stages: Dict[str, float] = {stage: 0. for stage in STAGES}
+        self._names: Dict[object, str] = {}
+        self._start = perf_counter()
+
+    def time_finder(self, change_finder, found: Iterable[ChangeSource],
+                    changed_keys: Set[str]) -> Iterator[ChangeSource]:
+        # Only time spent inside the finder counts, not time the consumer
+        # spends handling each source. changed_keys is the same set the
+        # finder removes the keys it accounts for from, so what it shrank by
+        # is what the finder consumed.
+        counters = self.finders[self._name(change_finder)]
+        counters.invocations += 1
+        keys_before = len(changed_keys)
+        start = perf_counter()
+        for source in found:
+            counters.seconds += perf_counter() - start
+            counters.sources += 1
+            yield source
+            start = perf_counter()
+        counters.seconds += perf_counter() - start
+        counters.keys_consumed += keys_before - len(changed_keys)
+
+    def time_stage(self, stage: str, items: Iterable[T]) -> Iterator[T]:
+        # Times how long each item takes to produce, e.g. fetching versions
+        iterator = iter(items)
+        while True:
+            start = perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stages[stage] += perf_counter() - start
+                return
+            self.stages[stage] += perf_counter() - start
+            yield item
+
+    def add_stage_time(self, stage: str, seconds: float):
+        self.stages[stage] += seconds
+
+    def version_done(self):
+        self.versions += 1
+        if self.report_every and self.versions % self.report_every == 0:
+            self.report()
+
+    def report(self):
+        log.info("Finder stats:\n%s", self.summary(),
+                 extra={'finder_stats': self.as_dict()})
+
+    def summary(self, top: int = 15) -> str:
+        elapsed = perf_counter() - self._start
+        lines = [f"{self.versions} versions in {elapsed:.1f}s "
+                 f"({self.versions / elapsed:.1f}/s)",
+                 "  stages: " + ", ".join(f"{stage} {seconds:.2f}s"
+                                          for stage, seconds
+                                          in self.stages.items())]
+        ranked = sorted(self.finders.items(), key=lambda item: -item[1].seconds)
+        for name, counters in ranked[:top]:
+            lines.append(f"  {counters.seconds:8.3f}s "
+                         f"{counters.invocations:8d} calls "
+                         f"{counters.sources:6d} sources "
+                         f"{counters.keys_consumed:6d} keys  {name}")
+        return "\n".join(lines)
+
+    def as_dict(self) -> dict:
+        return {
+            'versions': self.versions,
+            'elapsed': perf_counter() - self._start,
+            'stages': dict(self.stages),
+            'finders': {name: asdict(counters)
+                        for name, counters in self.finders.items()},
+        }
+
+    def dump(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def _name(self, change_finder) -> str:
+        try:
+            return self._names[change_finder]
+        except KeyError:
+            pass
+
+        if isinstance(change_finder, partial):
+            # Partials are told apart by their (enum) arguments
+            args = ', '.join(str(arg) for arg in change_finder.args
+                             if isinstance(arg, Enum))
+            name = f"{change_finder.func.__name__}({args})"
+        else:
+            name = change_finder.__name__
+        self._names[change_finder] = name
+        return name
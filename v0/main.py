@@ -1,14 +1,40 @@
+import argparse
+import logging
 from collections import Counter
+from time import perf_counter
 
 from blaseball_mike.chronicler import paged_get_lazy
+from blaseball_mike.session import session as mike_session
 
+import chron_archive
+import find_changes
+import pipeline_log
+import pipeline_metrics
 from ChangeSource import ChangeSourceType
+from change_sink import ChangeSink
+from change_memo import ChangeMemo
 from find_changes import get_change, session
+from finder_stats import FinderStats
+
+log = logging.getLogger(__name__)
 
 # CHRON_VERSIONS_URL = "http://127.0.0.1:8000/vcr/v2/versions"
 CHRON_VERSIONS_URL = "https://api.sibr.dev/chronicler/v2/versions"
 
-# Don't print these changes because they clutter up the output
+# Where --change-memo keeps finder outputs, so reruns only re-evaluate
+# finders that changed. Delete the file to force a full rerun.
+CHANGE_MEMO_PATH = "change-memo.sqlite"
+
+# Per-finder and per-stage timings are logged at INFO every this many
+# versions and dumped as JSON at the end of the run
+STATS_REPORT_EVERY = 10000
+STATS_PATH = "finder-stats.json"
+
+# Every classified change, including the IGNORED_EVENTS that aren't printed,
+# is written here for later querying
+CHANGES_DB_PATH = "changes.sqlite"
+
+# Don't log these changes because they clutter up the output
 IGNORED_EVENTS = {
     ChangeSourceType.TRAJ_RESET,
     ChangeSourceType.HITS_TRACKER,
@@ -16,21 +42,77 @@ IGNORED_EVENTS = {
 
 
 def main():
-    outputs = map(get_change, paged_get_lazy(CHRON_VERSIONS_URL, {
-        'duration': 'player',
-        'order': 'asc',
-    }, session))
+    parser = argparse.ArgumentParser(
+        description="Find the causes of every chron player version")
+    parser.add_argument('--archive', default=chron_archive.ARCHIVE_PATH,
+                        help="Where to archive Chronicler versions in place "
+                             "of the requests cache, or '' to use the "
+                             "requests cache")
+    parser.add_argument('--change-memo', nargs='?', const=CHANGE_MEMO_PATH,
+                        help="Memoize finder outputs in this SQLite file "
+                             f"(default {CHANGE_MEMO_PATH}) for later "
+                             "reruns. Each lookup costs more than most "
+                             "finders do, so it only pays off when rerunning "
+                             "over the event tables after editing a few "
+                             "finders.")
+    pipeline_log.add_arguments(parser)
+    pipeline_metrics.add_arguments(parser, 'v0')
+    args = parser.parse_args()
+    pipeline_log.configure_from_args(args)
+    metrics = find_changes.metrics = pipeline_metrics.from_args(args, 'v0')
+    metrics.watch_session(session)
 
-    counter = Counter()
+    if args.change_memo:
+        find_changes.change_memo = ChangeMemo(args.change_memo)
+    stats = find_changes.finder_stats = FinderStats(STATS_REPORT_EVERY)
+
+    params = {'duration': 'player', 'order': 'asc'}
+    archive = None
+    if args.archive:
+        # What the archive fetches isn't also put in the requests cache
+        archive = chron_archive.ChronArchive(args.archive)
+        metrics.watch_session(mike_session(0))
+        versions = archive.versions('player', None, lambda: paged_get_lazy(
+            CHRON_VERSIONS_URL, params, mike_session(0)))
+    else:
+        versions = paged_get_lazy(CHRON_VERSIONS_URL, params, session)
+    versions = stats.time_stage('fetch', versions)
+    outputs = map(get_change, versions)
 
-    for i, val in enumerate(outputs):
-        counter.update(s.source_type for s in val.sources)
-        val.sources = [s for s in val.sources
-                       if s.source_type not in IGNORED_EVENTS]
-        if not val.sources:
-            continue
+    counter = Counter()
+    try:
+        with ChangeSink(CHANGES_DB_PATH) as sink:
+            for i, val in enumerate(outputs):
+                output_start = perf_counter()
+                counter.update(s.source_type for s in val.sources)
+                sink.write(val.to_records())
+                if log.isEnabledFor(logging.INFO):
+                    val.sources = [s for s in val.sources
+                                   if s.source_type not in IGNORED_EVENTS]
+                    if val.sources:
+                        log.info("%d %s %s %s", i, val.after['name'],
+                                 val.valid_from, val.sources,
+                                 extra={'entity_id': val.player_id,
+                                        'valid_from': val.valid_from})
+                stats.add_stage_time('output', perf_counter() - output_start)
+                stats.version_done()
+                metrics.observe('versions', val.valid_from)
+    finally:
+        if archive is not None:
+            # Closing the versions first lets the archive write what it
+            # fetched before the run stopped
+            versions.close()
+            archive.close()
+    metrics.write()
+    stats.report()
+    stats.dump(STATS_PATH)
 
-        print(i, val.after['name'], val.valid_from, val.sources)
+    memo = find_changes.change_memo
+    if memo is not None:
+        log.info("Change memo: %d hits, %d misses", memo.hits, memo.misses,
+                 extra={'hits': memo.hits, 'misses': memo.misses})
+        memo.prune()
+        memo.close()
 
 
 # Press the green button in the gutter to run the script.
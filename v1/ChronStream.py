@@ -0,0 +1,178 @@
+import codecs
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from blaseball_mike.chronicler import v2 as chronicler_v2
+from blaseball_mike.session import TIMESTAMP_FORMAT, session
+
+import chron_archive
+
+# Bytes read from the response at a time. Comfortably bigger than one
+# player version, so most entries are decoded on the first try.
+CHUNK_SIZE = 64 * 1024
+PAGE_SIZE = 1000
+
+_WHITESPACE = ' \t\n\r'
+
+
+class PageDecoder:
+    """
+    Decodes a Chronicler page from an iterable of byte chunks, yielding the
+    entries of its list as each one is complete rather than after the whole
+    body has arrived. Only one entry is ever held decoded. The page's other
+    fields, like nextPage, are in `fields` once iteration has finished.
+
+    Each value is handed to the json module's decoder once the buffer holds
+    all of it. An entry that's cut off by the end of a chunk fails to
+    decode, and is tried again once the next chunk is in.
+    """
+
+    def __init__(self, chunks: Iterable[bytes],
+                 list_keys: Iterable[str] = ('items', 'data')):
+        self.fields: Dict[str, Any] = {}
+        self._chunks = iter(chunks)
+        self._list_keys = set(list_keys)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._finished = False
+
+    def __iter__(self) -> Iterator[Any]:
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key in self._list_keys and self._peek() == '[':
+                self._expect('[')
+                if self._peek() != ']':
+                    while True:
+                        yield self._value()
+                        if self._separator(']'):
+                            break
+                else:
+                    self._expect(']')
+            else:
+                self.fields[key] = self._value()
+            if self._separator('}'):
+                break
+
+    def _read(self) -> bool:
+        # Adds the next chunk to the buffer, dropping what's been consumed.
+        # False if the body has run out.
+        if self._finished:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._finished = True
+            text = self._utf8.decode(b'', final=True)
+        else:
+            text = self._utf8.decode(chunk)
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        # The next non-whitespace character, without consuming it
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                raise ValueError("Chronicler response ended early")
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} in Chronicler response at "
+                             f"{self._buffer[self._pos:self._pos + 20]!r}")
+        self._pos += 1
+
+    def _separator(self, close: str) -> bool:
+        # Consumes a comma or `close`, and says whether it was `close`
+        if self._peek() == close:
+            self._pos += 1
+            return True
+        self._expect(',')
+        return False
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            # A number at the very end of the buffer might go on in the next
+            # chunk, so a value only counts once something follows it
+            if end < len(self._buffer) or not self._read():
+                self._pos = end
+                return value
+
+
+def paged_get(url: str, params: dict, cache_time: Optional[int],
+              page_size: int = PAGE_SIZE) -> Iterator[dict]:
+    """
+    Like blaseball_mike's lazy paged_get, but each page is streamed and its
+    entries yielded as they're decoded. Responses requests_cache has stored
+    are decoded from the stored bytes the same way.
+    """
+    params = dict(params, count=page_size)
+    while True:
+        with session(cache_time).get(url, params=params,
+                                     stream=True) as response:
+            response.raise_for_status()
+            page = PageDecoder(response.iter_content(CHUNK_SIZE))
+            items = 0
+            for item in page:
+                items += 1
+                yield item
+
+        next_page = page.fields.get('nextPage')
+        if next_page is None or items < page_size:
+            return
+        params['page'] = next_page
+
+
+def _timestamp(time: Optional[datetime]) -> Optional[str]:
+    # Formatted the way blaseball_mike does, so cached responses from its
+    # requests are reused
+    return time.strftime(TIMESTAMP_FORMAT) if time is not None else None
+
+
+def get_versions(type_: str, after: Optional[datetime] = None,
+                 order: Optional[str] = None,
+                 cache_time: Optional[int] = 5) -> Iterator[dict]:
+    params = {'type': type_}
+    if after is not None:
+        params['after'] = _timestamp(after)
+    if order is not None:
+        params['order'] = order
+    url = f"{chronicler_v2.BASE_URL_V2}/versions"
+    # The archive stands in for a cache that never expires, and only keeps
+    # versions oldest first. What it fetches isn't also put in
+    # requests_cache.
+    if cache_time is None and chron_archive.archive is not None and \
+            order in (None, 'asc'):
+        return chron_archive.archive.versions(
+            type_, after, lambda: paged_get(url, params, 0))
+    return paged_get(url, params, cache_time)
+
+
+def get_entities(type_: str, at: Optional[datetime] = None,
+                 cache_time: Optional[int] = 5) -> Iterator[dict]:
+    params = {'type': type_}
+    if at is not None:
+        params['at'] = _timestamp(at)
+    url = f"{chronicler_v2.BASE_URL_V2}/entities"
+    if cache_time is None and chron_archive.archive is not None and \
+            at is not None:
+        return chron_archive.archive.entities(
+            type_, at, lambda: paged_get(url, params, 0))
+    return paged_get(url, params, cache_time)
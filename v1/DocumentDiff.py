@@ -0,0 +1,89 @@
+from typing import Any, List, NamedTuple, Optional, Tuple, Union
+
+Path = Tuple[Union[str, int], ...]
+
+
+class _Missing:
+    def __repr__(self):
+        return '<missing>'
+
+
+# Stands in for the value on the side of a Difference that doesn't have the
+# key or list index at all
+MISSING = _Missing()
+
+
+class Difference(NamedTuple):
+    path: Path
+    chron: Any
+    ours: Any
+
+    def describe(self) -> str:
+        if self.chron is MISSING:
+            return f"Chron is missing {format_path(self.path)}"
+        if self.ours is MISSING:
+            return f"Chron has additional {format_path(self.path)}"
+        if type(self.chron) is not type(self.ours):
+            return (f"Mismatched type for {format_path(self.path)}, expected "
+                    f"{type(self.ours)} but chron has {type(self.chron)}")
+        return (f"Mismatched value for {format_path(self.path)}, expected "
+                f"{self.ours!r} but chron has {self.chron!r}")
+
+
+def format_path(path: Path) -> str:
+    return "".join(f".{key}" for key in path) or "."
+
+
+def _flatten(path) -> Path:
+    # Paths are built as (parent, key) pairs while walking, and only turned
+    # into tuples for the differences that get reported
+    keys = []
+    while path is not None:
+        path, key = path
+        keys.append(key)
+    return tuple(reversed(keys))
+
+
+def diff_documents(chron: Any, ours: Any,
+                   limit: Optional[int] = None) -> List[Difference]:
+    """
+    Every difference between two JSON documents, in document order, or the
+    first `limit` of them. Walks the documents with an explicit stack, and
+    doesn't descend into subtrees that are identical. That check runs in C,
+    so it acts as the digest check for identical subtrees without having to
+    keep digests of documents that get modified in place.
+
+    Values of different types are always a difference, even if they compare
+    equal, like 1 and 1.0 or 1 and True, however deep they are.
+    """
+    differences = []
+    stack = [(chron, ours, None)]
+    while stack:
+        chron, ours, path = stack.pop()
+        if chron is ours:
+            continue
+        if type(chron) is not type(ours) or \
+                not isinstance(chron, (dict, list)):
+            if type(chron) is not type(ours) or chron != ours:
+                differences.append(Difference(_flatten(path), chron, ours))
+                if limit is not None and len(differences) >= limit:
+                    break
+            continue
+        # == alone would skip a subtree that only differs by a 1 and a 1.0,
+        # which repr tells apart. Equal subtrees that repr differently, like
+        # dicts in another key order, are walked and nothing is reported.
+        if chron == ours and repr(chron) == repr(ours):
+            continue
+
+        # Pushed in reverse so they come off the stack in document order
+        if isinstance(chron, dict):
+            keys = list(chron) + [key for key in ours if key not in chron]
+            for key in reversed(keys):
+                stack.append((chron.get(key, MISSING), ours.get(key, MISSING),
+                              (path, key)))
+        else:
+            for i in reversed(range(max(len(chron), len(ours)))):
+                stack.append((chron[i] if i < len(chron) else MISSING,
+                              ours[i] if i < len(ours) else MISSING,
+                              (path, i)))
+    return differences
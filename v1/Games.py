@@ -0,0 +1,105 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+
+@dataclass
+class GameState:
+    game_id: str
+    last_event: datetime
+    batter: Optional[str] = None
+    pitcher: Optional[str] = None
+    # In the order they got on base. Best effort: runners are added on hits
+    # and walks and cleared by home runs and half inning changes, but the feed
+    # doesn't say when a runner scores or is thrown out on the bases.
+    baserunners: List[str] = field(default_factory=list)
+
+    def _half_inning(self, event: dict) -> None:
+        self.batter = None
+        self.baserunners.clear()
+
+    def _pitcher_change(self, event: dict) -> None:
+        self.pitcher = event['playerTags'][0]
+
+    def _batter_up(self, event: dict) -> None:
+        self.batter = event['playerTags'][0]
+
+    def _batter_reaches_base(self, event: dict) -> None:
+        if self.batter is not None:
+            self.baserunners.append(self.batter)
+        self.batter = None
+
+    def _batter_out(self, event: dict) -> None:
+        self.batter = None
+
+    def _home_run(self, event: dict) -> None:
+        self.batter = None
+        self.baserunners.clear()
+
+    _handlers = {
+        2: _half_inning,
+        3: _pitcher_change,
+        5: _batter_reaches_base,  # walk
+        6: _batter_out,  # strikeout
+        7: _batter_out,  # flyout
+        8: _batter_out,  # ground out
+        9: _home_run,
+        10: _batter_reaches_base,  # hit
+        12: _batter_up,
+    }
+
+
+class Games:
+    """
+    Who is batting, pitching and on base in every game in progress, kept up
+    to date from the same feed events that go to Players. A game is dropped
+    when its game end event arrives, or if it hasn't had an event in
+    `idle_timeout` (the stream started or stopped partway through it).
+    """
+
+    def __init__(self, idle_timeout: timedelta = timedelta(hours=1)):
+        self.idle_timeout = idle_timeout
+        self.games: Dict[str, GameState] = {}
+        self._next_eviction: Optional[datetime] = None
+
+    def __len__(self):
+        return len(self.games)
+
+    def apply_event(self, event: dict) -> None:
+        if len(event['gameTags']) != 1:
+            return
+        game_id = event['gameTags'][0]
+        timestamp = event['created']
+        self._evict_idle(timestamp)
+
+        if event['type'] == 11:  # game end
+            self.games.pop(game_id, None)
+            return
+
+        game = self.games.get(game_id)
+        if game is None:
+            game = self.games[game_id] = GameState(game_id, timestamp)
+        game.last_event = timestamp
+
+        handler = GameState._handlers.get(event['type'])
+        if handler is not None:
+            handler(game, event)
+
+    def batter(self, event: dict) -> Optional[str]:
+        # The batter at the time of `event`, if the game has seen a batter up.
+        # Hit and out events have to be looked up before they're applied,
+        # since applying them moves the batter on.
+        if len(event['gameTags']) != 1:
+            return None
+        game = self.games.get(event['gameTags'][0])
+        return game.batter if game is not None else None
+
+    def _evict_idle(self, now: datetime) -> None:
+        # Checking every game on every event would make this quadratic, so
+        # only look once per idle_timeout
+        if self._next_eviction is not None and now < self._next_eviction:
+            return
+        self._next_eviction = now + self.idle_timeout
+        for game_id in [game_id for game_id, game in self.games.items()
+                        if now - game.last_event > self.idle_timeout]:
+            del self.games[game_id]
@@ -0,0 +1,132 @@
+from bisect import bisect_right
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Collection, Dict, Iterable, Iterator, List, Optional, \
+    Set, Tuple
+
+from roster_index import RosterIndex
+
+
+class _Automaton:
+    """
+    Aho-Corasick automaton over a fixed set of patterns. Finds every
+    occurrence of every pattern in one pass over the text.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # Lengths of the patterns that end at each state, including the ones
+        # reachable through fail links
+        self.output: List[List[int]] = [[]]
+
+        for pattern in patterns:
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(len(pattern))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = \
+                    self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text: str) -> Iterator[Tuple[int, int]]:
+        # Yields (start, end) of every match, ordered by end
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length in self.output[state]:
+                yield i + 1 - length, i + 1
+
+
+def _is_word_char(text: str, i: int) -> bool:
+    return 0 <= i < len(text) and (text[i].isalnum() or text[i] == "'")
+
+
+class NameResolver:
+    """
+    Finds which players an event's text is talking about. Every name any
+    player has had goes into one automaton, so a description is matched
+    against all of them in a single pass. A name only resolves to a player
+    if it was that player's name at the time of the event and the player was
+    on a roster then. Players the roster index has never heard of are treated
+    as always rostered.
+    """
+
+    def __init__(self, rosters: Optional[RosterIndex] = None):
+        self._names: Dict[str, List[str]] = defaultdict(list)
+        # Parallel to _names so name_at can bisect it
+        self._name_times: Dict[str, List[datetime]] = defaultdict(list)
+        self._ids_by_name: Dict[str, Set[str]] = defaultdict(set)
+        self._rosters = rosters
+        self._automaton: Optional[_Automaton] = None
+
+    def add_name(self, player_id: str, name: str,
+                 valid_from: datetime) -> None:
+        names, times = self._names[player_id], self._name_times[player_id]
+        if names and names[-1] == name:
+            return
+        assert not times or times[-1] <= valid_from
+        names.append(name)
+        times.append(valid_from)
+        if name not in self._ids_by_name:
+            self._automaton = None
+        self._ids_by_name[name].add(player_id)
+
+    def name_at(self, player_id: str, at: datetime) -> Optional[str]:
+        i = bisect_right(self._name_times.get(player_id, []), at) - 1
+        return self._names[player_id][i] if i >= 0 else None
+
+    def is_rostered(self, player_id: str, at: datetime) -> bool:
+        if self._rosters is None or not self._rosters.has_player(player_id):
+            return True
+        return self._rosters.team_at(player_id, at) is not None
+
+    def players_in(self, text: str, at: datetime,
+                   hint: Collection[str] = ()) -> List[str]:
+        """
+        Ids of the players named in `text`, in the order they appear. Where
+        two players shared a name at the time, the one in `hint` (usually the
+        event's playerTags) wins.
+        """
+        if self._automaton is None:
+            self._automaton = _Automaton(self._ids_by_name)
+
+        # Leftmost-longest, so "Jessica Telephone" isn't also read as a
+        # player named "Jess"
+        matches = sorted(((start, -end) for start, end
+                          in self._automaton.find(text)
+                          if not _is_word_char(text, start - 1) and
+                          not _is_word_char(text, end)))
+        player_ids, covered = [], 0
+        for start, end in matches:
+            end = -end
+            if start < covered:
+                continue
+            name = text[start:end]
+            candidates = [player_id for player_id in self._ids_by_name[name]
+                          if self.name_at(player_id, at) == name and
+                          self.is_rostered(player_id, at)]
+            if len(candidates) > 1:
+                candidates = [c for c in candidates if c in hint]
+            if len(candidates) > 1:
+                raise RuntimeError(f"Ambiguous name {name} at {at}")
+            if candidates:
+                player_ids.append(candidates[0])
+                covered = end
+        return player_ids
@@ -0,0 +1,99 @@
+from bisect import bisect_right
+from copy import deepcopy
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List
+
+from Player import Player
+from Players import Change, Players
+
+
+@dataclass
+class Keyframe:
+    # Number of logged changes that are already reflected in `entry`
+    log_index: int
+    # Timestamp of the last of those changes, or the start time
+    timestamp: datetime
+    # Chron entry (entityId, hash, validFrom, data) for the player's state
+    entry: dict
+
+
+class PlayerHistory:
+    """
+    Answers "what did this player look like at time t" without replaying
+    from the start. Every player's associated changes are logged in order,
+    and every `keyframe_interval` changes the chron entry that accounted for
+    them is kept as a keyframe. A lookup starts from the nearest keyframe at
+    or before t and applies at most `keyframe_interval` changes.
+
+    A smaller interval makes lookups faster at the cost of storing more
+    keyframes.
+    """
+
+    def __init__(self, start_time: datetime, keyframe_interval: int = 64):
+        assert keyframe_interval > 0
+        self.start_time = start_time
+        self.keyframe_interval = keyframe_interval
+        self.keyframes: Dict[str, List[Keyframe]] = {}
+        self.log: Dict[str, List[Change]] = {}
+        # Kept parallel to keyframes and log so lookups can bisect them
+        self._keyframe_times: Dict[str, List[datetime]] = {}
+        self._log_times: Dict[str, List[datetime]] = {}
+
+    @classmethod
+    def from_players(cls, players: Players, start_time: datetime,
+                     keyframe_interval: int = 64) -> 'PlayerHistory':
+        history = cls(start_time, keyframe_interval)
+        for player in players.players.values():
+            history.add_player(player)
+        return history
+
+    def add_player(self, player: Player) -> None:
+        entry = {'entityId': player.entityId, 'hash': player.hash,
+                 'validFrom': player.validFrom, 'data': deepcopy(player.data)}
+        self.keyframes[player.entityId] = \
+            [Keyframe(0, self.start_time, entry)]
+        self._keyframe_times[player.entityId] = [self.start_time]
+        self.log[player.entityId] = []
+        self._log_times[player.entityId] = []
+
+    def record(self, chron_update: dict, changes: List[Change]) -> None:
+        # Takes the (chron update, changes) pairs yielded by
+        # Players.associate_chron_updates
+        player_id = chron_update['entityId']
+        if player_id not in self.log:
+            # A player who was born after the start time
+            self.keyframes[player_id] = []
+            self._keyframe_times[player_id] = []
+            self.log[player_id] = []
+            self._log_times[player_id] = []
+
+        log = self.log[player_id]
+        log.extend(changes)
+        self._log_times[player_id].extend(c.timestamp for c in changes)
+
+        keyframes = self.keyframes[player_id]
+        if (not keyframes or
+                len(log) - keyframes[-1].log_index >= self.keyframe_interval):
+            # The chron entry is exactly the state after every change that
+            # has been logged so far, since that's what it was matched against
+            timestamp = log[-1].timestamp if log else chron_update['validFrom']
+            keyframes.append(Keyframe(len(log), timestamp, chron_update))
+            self._keyframe_times[player_id].append(timestamp)
+
+    def player_at(self, player_id: str, timestamp: datetime) -> Player:
+        i = bisect_right(self._keyframe_times[player_id], timestamp) - 1
+        if i < 0:
+            raise ValueError(f"No state recorded for {player_id} at or before "
+                             f"{timestamp}")
+
+        keyframe = self.keyframes[player_id][i]
+        end = bisect_right(self._log_times[player_id], timestamp,
+                           lo=keyframe.log_index)
+        player = Player(deepcopy(keyframe.entry))
+        for change in self.log[player_id][keyframe.log_index:end]:
+            change.apply(player)
+        return player
+
+    def keyframe_count(self) -> int:
+        return sum(len(keyframes) for keyframes in self.keyframes.values())
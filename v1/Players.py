@@ -1,15 +1,22 @@
+import logging
 from collections import defaultdict
 from copy import copy, deepcopy
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from enum import Enum, auto, IntEnum
-from typing import List, Tuple, Dict, Optional, Any
-from dictdiffer import diff
-
-from blaseball_mike.chronicler import get_entities
+from typing import List, Tuple, Dict, Optional, Any, Set, Iterable, \
+    MutableMapping, Sequence
 
 from ChangeSource import ChangeSource
+from ChronStream import get_entities
+from DocumentDiff import diff_documents
+from Games import Games
+from NameResolver import NameResolver
 from Player import Player
+from id_intern import ids
+from roster_index import RosterIndex
+
+log = logging.getLogger(__name__)
 
 
 class TimestampSource(Enum):
@@ -19,6 +26,22 @@ class TimestampSource(Enum):
     MANUAL = auto()
 
 
+class Verification(Enum):
+    """
+    How associate_chron_updates checks that applying the matched changes to
+    a player really gives the data chron recorded
+    """
+    # Take the copy the changes were matched on as the new player
+    OFF = 'off'
+    # Apply the changes to the player and compare a structural hash of just
+    # the keys they changed
+    HASH = 'hash'
+    # ALWAYS for every `verify_every`th update, OFF for the rest
+    SAMPLED = 'sampled'
+    # Apply the changes to the player and compare the whole document
+    ALWAYS = 'always'
+
+
 class ModDuration(IntEnum):
     PERMANENT = 0
     SEASON = 1
@@ -28,10 +51,17 @@ class ModDuration(IntEnum):
     LEAGUE = 5
 
 
+# Effects and changes are made for every feed event, so they're slotted to
+# keep them small. Each class lists only the fields it adds.
 class Effect:
+    __slots__ = ()
+
     def apply(self, player: Player) -> None:
         raise NotImplementedError("Don't instantiate Effect")
 
+    def keys_changed(self) -> Set[str]:
+        raise NotImplementedError("Don't instantiate Effect")
+
 
 def _duration_attribute(duration: ModDuration) -> Optional[str]:
     if duration == ModDuration.GAME:
@@ -47,6 +77,7 @@ def _duration_attribute(duration: ModDuration) -> Optional[str]:
 
 @dataclass
 class ModEffect(Effect):
+    __slots__ = ('from_mod', 'to_mod', 'type')
     from_mod: Optional[str]
     to_mod: Optional[str]
     type: ModDuration
@@ -63,25 +94,50 @@ class ModEffect(Effect):
         if self.to_mod is not None:
             player.data[attribute].append(self.to_mod)
 
+    def keys_changed(self) -> Set[str]:
+        attribute = _duration_attribute(self.type)
+        return {attribute} if attribute is not None else set()
+
 
 @dataclass
 class SetStateEffect(Effect):
+    __slots__ = ('path', 'value')
     path: List[str]
     value: Any
 
     def apply(self, player: Player) -> None:
         player.set_state(self.path, self.value)
 
-@dataclass
-class IncrementCounterEffect(Effect):
-    path: List[str]
+    def keys_changed(self) -> Set[str]:
+        return {'state'}
+
+
+@dataclass(frozen=True)
+class _CounterEffect(Effect):
+    # Frozen, so one instance can be shared by every change that uses it
+    __slots__ = ('path',)
+    path: Tuple[str, ...]
+
+    def keys_changed(self) -> Set[str]:
+        return {self.path[0]}
+
+    def __reduce__(self):
+        # The default unpickling sets each slot, which a frozen dataclass
+        # refuses
+        return type(self), (self.path,)
+
+
+@dataclass(frozen=True)
+class IncrementCounterEffect(_CounterEffect):
+    __slots__ = ()
 
     def apply(self, player: Player) -> None:
         player.increment_counter(self.path)
 
-@dataclass
-class ResetCounterEffect(Effect):
-    path: List[str]
+
+@dataclass(frozen=True)
+class ResetCounterEffect(_CounterEffect):
+    __slots__ = ()
 
     def apply(self, player: Player) -> None:
         player.reset_counter(self.path)
@@ -89,15 +145,25 @@ class ResetCounterEffect(Effect):
 
 @dataclass
 class Change:
+    __slots__ = ('source', 'timestamp', 'timestamp_source', 'effects')
     source: ChangeSource
     timestamp: datetime
     timestamp_source: TimestampSource
-    effects: List[Effect]
+    effects: Sequence[Effect]
 
     def apply(self, player: Player) -> None:
         for effect in self.effects:
             effect.apply(player)
 
+    def keys_changed(self) -> Set[str]:
+        return set().union(*(effect.keys_changed() for effect in self.effects))
+
+
+# Counter effects don't depend on the event, so every hit and non-hit shares
+# the same effects
+_HIT_EFFECTS = (IncrementCounterEffect(('consecutiveHits',)),)
+_NON_HIT_EFFECTS = (ResetCounterEffect(('consecutiveHits',)),)
+
 
 def _get_mod_effect(event: dict) -> ModEffect:
     metadata = event['metadata']
@@ -122,57 +188,76 @@ def _player_id(event: dict) -> str:
     return event['playerTags'][0]
 
 
-def check_equality_recursive(chron: dict, ours: dict, path=""):
-    if type(chron) != type(ours):
-        raise RuntimeError(f"Mismatched type for {path}, expected " +
-                           str(type(ours)) + " but chron has " +
-                           str(type(chron)))
-
-    if isinstance(chron, list):
-        if len(chron) != len(ours):
-            raise RuntimeError(f"Mismatched length for {path}, expected " +
-                               str(len(ours)) + " but chron has " +
-                               str(len(chron)))
-
-        for i, (chron_elem, ours_elem) in enumerate(zip(chron, ours)):
-            check_equality_recursive(chron_elem, ours_elem, f"{path}.{i}")
-
-    if isinstance(chron, dict):
-        chron_keys = set(chron.keys())
-        our_keys = set(ours.keys())
+def structural_hash(value: Any) -> int:
+    # Equal for equal JSON values. Dict key order doesn't matter, list order
+    # does.
+    if isinstance(value, dict):
+        return hash(frozenset((key, structural_hash(item))
+                              for key, item in value.items()))
+    if isinstance(value, list):
+        return hash(tuple(structural_hash(item) for item in value))
+    return hash(value)
 
-        if chron_keys - our_keys:
-            raise RuntimeError(f"Chron has additional key(s) for {path}: " +
-                               ", ".join(chron_keys - our_keys))
 
-        if our_keys - chron_keys:
-            raise RuntimeError(f"Chron is missing key(s) for {path}: " +
-                               ", ".join(our_keys - chron_keys))
-
-        assert chron_keys == our_keys
-        for key in chron_keys:
-            check_equality_recursive(chron[key], ours[key], f"{path}.{key}")
+def check_equality_recursive(chron: dict, ours: dict, path=""):
+    # Raises describing the first difference, if there is one
+    differences = diff_documents(chron, ours, limit=1)
+    if differences:
+        raise RuntimeError(f"{path}: {differences[0].describe()}" if path
+                           else differences[0].describe())
 
 
 class Players:
-    def __init__(self, start_time: datetime):
-        self.players: Dict[str, Player] = {}
-        self.changes: Dict[str, List[Change]] = defaultdict(lambda: [])
-
-        for player in get_entities("player",
-                                   at=start_time,
-                                   cache_time=None):
-            self.players[player['entityId']] = Player(player)
+    def __init__(self, start_time: datetime,
+                 initial_players: Optional[Iterable[dict]] = None,
+                 names: Optional[NameResolver] = None,
+                 verification: Verification = Verification.ALWAYS,
+                 verify_every: int = 100,
+                 player_store: Optional[MutableMapping[int, Player]] = None,
+                 change_store: Optional[MutableMapping[int, List[Change]]]
+                 = None):
+        # Both can be changed between updates
+        self.verification = verification
+        self.verify_every = verify_every
+        self._updates_seen = 0
+        # Plain dicts unless stores are passed in, like SqliteStore to keep
+        # only the active players in memory. A change store has to create
+        # empty lists for missing players, like the defaultdict does. All
+        # three are keyed on player ids interned with id_intern.ids.
+        self.players: MutableMapping[int, Player] = \
+            player_store if player_store is not None else {}
+        self.changes: MutableMapping[int, List[Change]] = \
+            change_store if change_store is not None else defaultdict(list)
+        # (oldest pending change time, pending change count) for every
+        # player with pending changes. Always in memory, so checking for
+        # stale changes doesn't have to go through every player.
+        self._pending: Dict[int, Tuple[datetime, int]] = {}
+        self.names = names if names is not None else \
+            NameResolver(RosterIndex.from_csv())
+        self.games = Games()
+
+        # initial_players takes chron entries in place of fetching them, for
+        # running against data that isn't in Chronicler
+        if initial_players is None:
+            initial_players = get_entities("player",
+                                           at=start_time,
+                                           cache_time=None)
+        for player in initial_players:
+            self.players[ids.intern(player['entityId'])] = Player(player)
+            self.names.add_name(player['entityId'], player['data']['name'],
+                                start_time)
 
     def associate_chron_updates(self, chron_updates: List[dict]):
         assert len(chron_updates) > 0
         chron_update_time = chron_updates[0]['validFrom']
         for chron_update in chron_updates:
-            player_id = chron_update['entityId']
+            player_id = ids.intern(chron_update['entityId'])
 
+            pending = self.changes[player_id] \
+                if player_id in self._pending else []
             player = deepcopy(self.players[player_id])
             last_matching_player, last_matching_i = None, None
-            for i, change in enumerate(self.changes[player_id]):
+            for i, change in enumerate(pending):
                 change.apply(player)
 
                 if player.data == chron_update['data']:
@@ -180,39 +265,135 @@ class Players:
                     last_matching_player = deepcopy(player)
 
             if last_matching_i is None:
-                print(list(diff(self.players[player_id].data,
-                                chron_update['data'])))
+                log.error("Unable to account for chron change to %s",
+                          chron_update['entityId'],
+                          extra={'diff': [
+                              difference.describe() for difference
+                              in diff_documents(chron_update['data'],
+                                                self.players[player_id].data)
+                          ]})
                 raise RuntimeError("Unable to account for chron change")
 
             # Changes up to last_matching_i are yielded, the rest are saved for
             # the next chron update
             last_matching_i += 1
-            changes = self.changes[player_id][:last_matching_i]
-            self.changes[player_id] = self.changes[player_id][last_matching_i:]
+            changes = pending[:last_matching_i]
+            self._set_changes(player_id, pending[last_matching_i:])
 
-            # Verification
-            for change in changes:
-                change.apply(self.players[player_id])
-            assert self.players[player_id].data == last_matching_player.data
+            self._verify(player_id, changes, last_matching_player)
 
+            self.names.add_name(chron_update['entityId'],
+                                chron_update['data']['name'],
+                                chron_update['validFrom'])
             yield chron_update, changes
 
-        for key, changes in self.changes.items():
-            for change in changes:
-                if chron_update_time - change.timestamp > timedelta(seconds=300):
-                    raise RuntimeError("Chron update didn't account for "
-                                       f"{len(changes)} changes to ${key}")
+        for key in [key for key in self._pending
+                    if self._has_stale_change(key, chron_update_time)]:
+            self._drop_unobservable_changes(key)
+            if self._has_stale_change(key, chron_update_time):
+                raise RuntimeError("Chron update didn't account for "
+                                   f"{len(self.changes[key])} changes to "
+                                   f"${ids.uuid(key)}")
+
+    def _set_changes(self, player_id: int, changes: List[Change]) -> None:
+        self.changes[player_id] = changes
+        if changes:
+            self._pending[player_id] = \
+                (min(change.timestamp for change in changes), len(changes))
+        else:
+            self._pending.pop(player_id, None)
+
+    def pending_counts(self) -> List[int]:
+        # Pending changes for each player that has any
+        return [count for _, count in self._pending.values()]
+
+    def _verify(self, player_id: int, changes: List[Change],
+                matched: Player) -> None:
+        # Moves the player on to `matched`, the copy the changes were matched
+        # on, checking as much as self.verification asks for along the way
+        self._updates_seen += 1
+        verification = self.verification
+        if verification == Verification.SAMPLED:
+            verification = Verification.ALWAYS \
+                if self._updates_seen % self.verify_every == 0 \
+                else Verification.OFF
+
+        if verification == Verification.OFF:
+            self.players[player_id] = matched
+            return
+
+        player = self.players[player_id]
+        for change in changes:
+            change.apply(player)
+
+        if verification == Verification.HASH:
+            keys = set().union(*(change.keys_changed() for change in changes))
+            if any(structural_hash(player.data.get(key)) !=
+                   structural_hash(matched.data.get(key)) for key in keys):
+                raise RuntimeError(f"Changes to {ids.uuid(player_id)} didn't "
+                                   f"reapply to the same "
+                                   f"{', '.join(sorted(keys))}")
+        elif player.data != matched.data:
+            # Raises with the path of the first difference
+            check_equality_recursive(player.data, matched.data)
+            raise RuntimeError(f"Changes to {ids.uuid(player_id)} didn't "
+                               f"reapply to the same data")
+
+    def _has_stale_change(self, player_id: int, at: datetime) -> bool:
+        pending = self._pending.get(player_id)
+        return pending is not None and \
+            at - pending[0] > timedelta(seconds=300)
+
+    def _drop_unobservable_changes(self, player_id: int) -> None:
+        # Chron only records a version when the data changes, so changes that
+        # leave the player as they were (like a non-hit resetting a counter
+        # that's already 0) are never going to be matched. Drop the longest
+        # run of pending changes that nets out to nothing.
+        player = deepcopy(self.players[player_id])
+        last_unchanged_i = None
+        for i, change in enumerate(self.changes[player_id]):
+            change.apply(player)
+            if player.data == self.players[player_id].data:
+                last_unchanged_i = i
+        if last_unchanged_i is not None:
+            self._set_changes(player_id,
+                              self.changes[player_id][last_unchanged_i + 1:])
 
     def apply_event(self, event: dict) -> None:
-        print("Applying:", event['description'])
-        if 'parent' in event['metadata']:
-            changes = Players._find_change_by_parent_type[
-                event['metadata']['parent']['type']](self, event)
-        else:
-            changes = Players._find_change_by_own_type[
-                event['type']](self, event)
-        for player_id, change in changes:
-            self.changes[player_id].append(change)
+        self.apply_events([event])
+
+    def apply_events(self, events: Iterable[dict]) -> None:
+        """
+        Applies a run of feed events with no chron updates between them. The
+        events are still handled in order, since who is batting depends on
+        the events before, but each player's new changes are collected and
+        added to their pending changes in one go at the end.
+        """
+        if log.isEnabledFor(logging.DEBUG):
+            events = list(events)
+            for event in events:
+                log.debug("Applying: %s", event['description'],
+                          extra={'event_id': event['id']})
+
+        new_changes: Dict[int, List[Change]] = defaultdict(list)
+        by_parent_type = Players._find_change_by_parent_type
+        by_own_type = Players._find_change_by_own_type
+        apply_to_games = self.games.apply_event
+        for event in events:
+            parent = event['metadata'].get('parent')
+            if parent is not None:
+                handler = by_parent_type[parent['type']]
+            else:
+                handler = by_own_type[event['type']]
+            if handler is not None:
+                for player_id, change in handler(self, event):
+                    new_changes[ids.intern(player_id)].append(change)
+            apply_to_games(event)
+
+        for player_id, changes in new_changes.items():
+            pending = self.changes[player_id]
+            pending.extend(changes)
+            self._set_changes(player_id, pending)
 
     def _find_change_superyummy(self, event: dict) -> List[Tuple[str, Change]]:
         mod_effect = _get_mod_effect(event)
@@ -222,7 +403,7 @@ class Players:
                  Change(source=ChangeSource.SUPERYUMMY,
                         timestamp=event['created'],
                         timestamp_source=TimestampSource.FEED,
-                        effects=[mod_effect, state_effect]))]
+                        effects=(mod_effect, state_effect)))]
 
     def _find_recorded_change_from_score(self, event: dict) \
             -> List[Tuple[str, Change]]:
@@ -231,27 +412,62 @@ class Players:
                      Change(source=ChangeSource.USE_FREE_REFILL,
                             timestamp=event['created'],
                             timestamp_source=TimestampSource.FEED,
-                            effects=[_get_mod_effect(event)]))]
+                            effects=(_get_mod_effect(event),)))]
 
         raise RuntimeError("Didn't find change type from hit")
 
+    def _batter_id(self, event: dict) -> Optional[str]:
+        batter_id = self.games.batter(event)
+        if batter_id is not None and batter_id in event['playerTags']:
+            return batter_id
+
+        # Otherwise the game started before the stream did. The batter is the
+        # first player named in hit and out descriptions. Flyouts and ground
+        # outs also name the fielder, so playerTags alone can't say which one
+        # batted.
+        try:
+            player_ids = self.names.players_in(event['description'],
+                                               event['created'],
+                                               hint=event['playerTags'])
+        except RuntimeError as e:
+            # An ambiguous name. One bad feed row shouldn't stop a follow
+            # run, so this falls through to the playerTags guess below.
+            log.warning("Couldn't resolve batter: %s", e,
+                        extra={'event_id': event['id']})
+            player_ids = []
+        if player_ids:
+            return player_ids[0]
+
+        if event['playerTags']:
+            log.warning("Couldn't find batter in \"%s\", using its first "
+                        "player tag", event['description'],
+                        extra={'event_id': event['id']})
+            return event['playerTags'][0]
+        log.warning("Couldn't find batter in \"%s\", skipping it",
+                    event['description'], extra={'event_id': event['id']})
+        return None
+
     def _find_unrecorded_change_from_hit(self, event: dict) \
             -> List[Tuple[str, Change]]:
-        # I hope the player who hit the hit is guaranteed to be first.
-        return [(event['playerTags'][0],
+        batter_id = self._batter_id(event)
+        if batter_id is None:
+            return []
+        return [(batter_id,
                  Change(source=ChangeSource.HIT,
                         timestamp=event['created'],
                         timestamp_source=TimestampSource.FEED,
-                        effects=[IncrementCounterEffect(['consecutiveHits'])]))]
+                        effects=_HIT_EFFECTS))]
 
     def _find_unrecorded_change_from_non_hit(self, event: dict) \
             -> List[Tuple[str, Change]]:
-        # TODO Get the player ID from blarser
-        return [("",
+        batter_id = self._batter_id(event)
+        if batter_id is None:
+            return []
+        return [(batter_id,
                  Change(source=ChangeSource.NON_HIT,
                         timestamp=event['created'],
                         timestamp_source=TimestampSource.FEED,
-                        effects=[ResetCounterEffect(['consecutiveHits'])]))]
+                        effects=_NON_HIT_EFFECTS))]
 
     _find_change_by_parent_type = {
         92: _find_change_superyummy,
@@ -260,8 +476,16 @@ class Players:
     }
 
     _find_change_by_own_type = {
-        7: _find_unrecorded_change_from_non_hit,
+        6: _find_unrecorded_change_from_non_hit,  # strikeout
+        7: _find_unrecorded_change_from_non_hit,  # flyout
+        8: _find_unrecorded_change_from_non_hit,  # ground out
         # 9 is a home run, which has the same effects as hit
         9: _find_unrecorded_change_from_hit,
         10: _find_unrecorded_change_from_hit,
+        # Only matter to Games
+        2: None,  # half inning
+        3: None,  # pitcher change
+        5: None,  # walk
+        11: None,  # game end
+        12: None,  # batter up
     }
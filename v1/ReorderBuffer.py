@@ -0,0 +1,90 @@
+import heapq
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+# (time, source, item), as the Scheduler yields them
+StreamItem = Tuple[datetime, str, Any]
+
+# The source of chron batches. Every other source is a feed query.
+CHRON_SOURCE = 'chron_updates'
+
+
+class ReorderBuffer:
+    """
+    Holds the merged feed and chron stream back by `allowed_lateness` so
+    anything that arrives up to that late still comes out in order. The
+    watermark is the latest time seen minus `allowed_lateness`, and items are
+    released once they're at or before it.
+
+    Chron batches are ordered as if they happened `chron_delay` after their
+    validFrom. Feed events can be timestamped a little after the scrape that
+    already reflects them, and Players can only account for a chron update
+    with events it has been given. Giving it a few extra events is harmless,
+    since it matches the chron update against every prefix of the pending
+    changes.
+
+    Anything that arrives after the watermark has already passed it can't be
+    put back in order. It's released immediately and counted in `late`.
+    """
+
+    def __init__(self, allowed_lateness: timedelta = timedelta(seconds=30),
+                 chron_delay: timedelta = timedelta(seconds=5)):
+        self.allowed_lateness = allowed_lateness
+        self.chron_delay = chron_delay
+        self.late = 0
+        self.max_buffered = 0
+        self._heap: List[Tuple[datetime, int, int, StreamItem]] = []
+        self._count = 0
+        self._latest: Optional[datetime] = None
+        self._released: Optional[datetime] = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, timestamp: datetime, source: str, item: Any) \
+            -> Iterator[StreamItem]:
+        # Feed events go before chron batches with the same key
+        if source == CHRON_SOURCE:
+            key, rank = timestamp + self.chron_delay, 1
+        else:
+            key, rank = timestamp, 0
+
+        if self._released is not None and key < self._released:
+            self.late += 1
+            yield timestamp, source, item
+            return
+
+        # The count keeps items with the same key in arrival order, and
+        # means the items themselves are never compared
+        heapq.heappush(self._heap, (key, rank, self._count,
+                                    (timestamp, source, item)))
+        self._count += 1
+        self.max_buffered = max(self.max_buffered, len(self._heap))
+
+        # The watermark follows the times items actually arrive with, so a
+        # chron batch's delay holds the batch back rather than moving the
+        # watermark forward
+        if self._latest is None or timestamp > self._latest:
+            self._latest = timestamp
+        watermark = self._latest - self.allowed_lateness
+        while self._heap and self._heap[0][0] <= watermark:
+            yield self._pop()
+
+    def flush(self) -> Iterator[StreamItem]:
+        while self._heap:
+            yield self._pop()
+
+    def push_all(self, stream: Iterable[StreamItem]) -> Iterator[StreamItem]:
+        # Unlike reorder, leaves whatever the watermark hasn't reached in the
+        # buffer, for when more of the stream is still to come
+        for timestamp, source, item in stream:
+            yield from self.push(timestamp, source, item)
+
+    def reorder(self, stream: Iterable[StreamItem]) -> Iterator[StreamItem]:
+        yield from self.push_all(stream)
+        yield from self.flush()
+
+    def _pop(self) -> StreamItem:
+        key, _, _, stream_item = heapq.heappop(self._heap)
+        self._released = key
+        return stream_item
@@ -0,0 +1,83 @@
+import heapq
+from dataclasses import dataclass
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# (time, source, item), as main.poll passes them to the reorder buffer
+StreamItem = Tuple[datetime, str, Any]
+
+
+@dataclass
+class SourceStats:
+    items: int = 0
+    # Time spent waiting on the source for its next item, which for the
+    # network sources is mostly fetching pages
+    seconds: float = 0.
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.
+
+
+class _Source:
+    def __init__(self, name: str, items: Iterable[Tuple[datetime, Any]],
+                 priority: int):
+        self.name = name
+        self.priority = priority
+        self.stats = SourceStats()
+        self._items = iter(items)
+
+    def next(self) -> Optional[Tuple[datetime, Any]]:
+        start = perf_counter()
+        head = next(self._items, None)
+        self.stats.seconds += perf_counter() - start
+        if head is not None:
+            self.stats.items += 1
+        return head
+
+
+class Scheduler:
+    """
+    Merges any number of time-ordered sources into one stream. Each source
+    is an iterable of (time, item) and is registered under a name, which is
+    what the merged stream labels its items with.
+
+    The merge is a heap over each source's next item, keyed on (time,
+    priority, sequence number), so items are never compared. At equal times
+    sources with a lower priority go first, and after that items come out in
+    the order they were read.
+    """
+
+    def __init__(self):
+        self._sources: List[_Source] = []
+
+    def add_source(self, name: str, items: Iterable[Tuple[datetime, Any]],
+                   priority: int = 0) -> None:
+        if any(source.name == name for source in self._sources):
+            raise ValueError(f"Source {name} is already registered")
+        self._sources.append(_Source(name, items, priority))
+
+    def stats(self) -> Dict[str, SourceStats]:
+        return {source.name: source.stats for source in self._sources}
+
+    def __iter__(self) -> Iterator[StreamItem]:
+        heap = []
+        sequence = 0
+        for source in self._sources:
+            head = source.next()
+            if head is not None:
+                heap.append((head[0], source.priority, sequence, source, head))
+                sequence += 1
+        heapq.heapify(heap)
+
+        while heap:
+            timestamp, priority, _, source, (_, item) = heap[0]
+            yield timestamp, source.name, item
+            head = source.next()
+            if head is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (head[0], priority, sequence, source,
+                                         head))
+                sequence += 1
@@ -0,0 +1,121 @@
+import pickle
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Callable, Iterator, MutableMapping, Optional
+
+# How many values SqliteStore keeps in memory by default
+CACHE_SIZE = 10000
+
+
+class SqliteStore(MutableMapping):
+    """
+    A dict of pickled values kept in a SQLite table under integer keys, like
+    interned ids, with the `capacity` most recently used in memory. Looking
+    up a missing key calls `default_factory` like a defaultdict, if there is
+    one.
+
+    Values are handed out by reference and callers modify them in place, so
+    the store can't tell which ones changed. Every value in memory is
+    written back when it's evicted or flushed. Evictions happen an eighth
+    of the capacity at a time, so each write is one batched transaction.
+
+    Pickling the store flushes it and keeps only where the table is, so an
+    object holding one can be pickled and picked up again later.
+    """
+
+    def __init__(self, path: str, table: str, capacity: int = CACHE_SIZE,
+                 default_factory: Optional[Callable[[], Any]] = None):
+        self.path = path
+        self.table = table
+        self.capacity = capacity
+        self.default_factory = default_factory
+        self._open()
+
+    def _open(self) -> None:
+        self._cache: OrderedDict = OrderedDict()
+        self._db = sqlite3.connect(self.path)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                         "(key INTEGER PRIMARY KEY, value BLOB NOT NULL)")
+
+    def __getitem__(self, key: int) -> Any:
+        value = self._cache.get(key)
+        if value is not None or key in self._cache:
+            self._cache.move_to_end(key)
+            return value
+
+        row = self._db.execute(f"SELECT value FROM {self.table} "
+                               "WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            value = pickle.loads(row[0])
+        elif self.default_factory is not None:
+            value = self.default_factory()
+        else:
+            raise KeyError(key)
+        self._put(key, value)
+        return value
+
+    def __setitem__(self, key: int, value: Any) -> None:
+        self._put(key, value)
+        self._cache.move_to_end(key)
+
+    def __delitem__(self, key: int) -> None:
+        in_cache = self._cache.pop(key, None) is not None
+        with self._db:
+            deleted = self._db.execute(f"DELETE FROM {self.table} "
+                                       "WHERE key = ?", (key,)).rowcount
+        if not in_cache and not deleted:
+            raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._cache or self._db.execute(
+            f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone() is not None
+
+    def __iter__(self) -> Iterator[int]:
+        # Goes through the table, so it's for occasional use like saving
+        # state, not the hot path
+        self.flush()
+        for key, in self._db.execute(f"SELECT key FROM {self.table}"):
+            yield key
+
+    def __len__(self) -> int:
+        self.flush()
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def clear(self) -> None:
+        # One statement, rather than MutableMapping's delete per key
+        self._cache.clear()
+        with self._db:
+            self._db.execute(f"DELETE FROM {self.table}")
+
+    def _put(self, key: int, value: Any) -> None:
+        self._cache[key] = value
+        if len(self._cache) > self.capacity:
+            self._write([self._cache.popitem(last=False)
+                         for _ in range(max(1, self.capacity // 8))])
+
+    def _write(self, items) -> None:
+        with self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)",
+                [(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                 for key, value in items])
+
+    def flush(self) -> None:
+        # Writes everything in memory back, keeping it cached
+        self._write(self._cache.items())
+
+    def close(self) -> None:
+        self.flush()
+        self._db.close()
+
+    def __getstate__(self) -> dict:
+        self.flush()
+        return {'path': self.path, 'table': self.table,
+                'capacity': self.capacity,
+                'default_factory': self.default_factory}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._open()
@@ -0,0 +1,254 @@
+import heapq
+import random
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from ReorderBuffer import CHRON_SOURCE
+
+START_TIME = datetime(2021, 3, 1, 15, tzinfo=timezone.utc)
+SEED = 0
+PLATE_APPEARANCES_PER_GAME = 70
+# Between the events of one plate appearance. Small enough that a plate
+# appearance is over before the next one starts at the shortest PA interval.
+EVENT_SPACING = timedelta(seconds=0.25)
+BATTERS_PER_TEAM = 9
+SUPERYUMMY_RATE = 0.05
+COFFEE_RALLY_RATE = 0.05
+# Chron scrapes players about once a minute, and what it records can be up to
+# half a minute behind the feed
+SCRAPE_INTERVAL = 60
+MAX_SCRAPE_LAG = 30
+
+# (event type, chance per plate appearance). Anything else is a walk.
+OUTCOMES = [(10, 0.2), (9, 0.03), (6, 0.25), (7, 0.2), (8, 0.2)]
+# Events that only go to Games, like main.get_associations' game_state feed
+GAME_STATE_TYPES = {2, 3, 5, 11, 12}
+
+# (time, source, item), in the same form as main.get_associations merges
+StreamItem = Tuple[datetime, str, Any]
+
+
+class SyntheticLeague:
+    """
+    Deterministic feed events and the chron batches that go with them. Teams
+    of nine batters play each other continuously, emitting a hit, home run,
+    strikeout, flyout, ground out or walk every plate appearance. Superyummy
+    players gain or flip Overperforming/Underperforming at the start of each
+    game and players with a Free Refill use it on their next hit.
+
+    The league keeps its own copy of every player's data, updated directly
+    rather than through Players, and chron batches are snapshots of that copy
+    taken a little before the batch's validFrom, so some events always land
+    after the snapshot and have to wait for the next batch.
+    """
+
+    def __init__(self, players: int, pa_interval: float, seed: int = SEED):
+        self.rng = random.Random(seed)
+        self.pa_interval = pa_interval
+        self.event_count = 0
+
+        self.entries: Dict[str, dict] = {}
+        for i in range(players):
+            player_id = f"00000000-0000-4000-8000-{i:012d}"
+            perm_attr = []
+            if self.rng.random() < SUPERYUMMY_RATE:
+                perm_attr.append('SUPERYUMMY')
+            if self.rng.random() < COFFEE_RALLY_RATE:
+                perm_attr.append('COFFEE_RALLY')
+            self.entries[player_id] = {
+                'entityId': player_id,
+                'hash': self._hash(),
+                'validFrom': START_TIME,
+                'data': {'id': player_id, 'name': f"Player {i}",
+                         'consecutiveHits': 0, 'permAttr': perm_attr,
+                         'seasAttr': [], 'weekAttr': [], 'gameAttr': [],
+                         'state': {}},
+            }
+
+        player_ids = list(self.entries)
+        teams = [player_ids[i:i + BATTERS_PER_TEAM]
+                 for i in range(0, len(player_ids), BATTERS_PER_TEAM)]
+        self.games = [(teams[i], teams[i + 1])
+                      for i in range(0, len(teams) - 1, 2)]
+
+        self._truth = {player_id: deepcopy(entry['data'])
+                       for player_id, entry in self.entries.items()}
+        self._last_recorded = deepcopy(self._truth)
+        self._dirty = set()
+        self._game_ids: List[Optional[str]] = [None] * len(self.games)
+        self._games_started = 0
+
+    def _hash(self) -> str:
+        return f"{self.rng.getrandbits(128):032x}"
+
+    def initial_players(self) -> List[dict]:
+        # Players mutates these, so every call gets its own copy
+        return deepcopy(list(self.entries.values()))
+
+    def stream(self, minutes: float) -> List[StreamItem]:
+        end = START_TIME + timedelta(minutes=minutes)
+        stream: List[Tuple[datetime, int, str, Any]] = []
+
+        def emit(timestamp: datetime, source: str, item: Any):
+            stream.append((timestamp, len(stream), source, item))
+
+        # Captures happen in feed order, but a capture's batch isn't published
+        # until its scrape time
+        captures = []
+        captured_at = START_TIME
+        scrape_time = START_TIME + timedelta(seconds=SCRAPE_INTERVAL)
+        while scrape_time < end:
+            lag = timedelta(seconds=self.rng.uniform(0, MAX_SCRAPE_LAG))
+            captured_at = max(captured_at, scrape_time - lag)
+            captures.append((captured_at, scrape_time))
+            scrape_time += timedelta(seconds=SCRAPE_INTERVAL)
+        captures.reverse()
+
+        upcoming = [(START_TIME, i, 0) for i in range(len(self.games))]
+        heapq.heapify(upcoming)
+        while upcoming[0][0] < end:
+            timestamp, game, pa = heapq.heappop(upcoming)
+            while captures and captures[-1][0] <= timestamp:
+                _, scrape_time = captures.pop()
+                batch = self._capture(scrape_time)
+                if batch:
+                    emit(scrape_time, CHRON_SOURCE, batch)
+
+            for event in self._plate_appearance(timestamp, game, pa):
+                emit(event['created'],
+                     'game_state' if event['type'] in GAME_STATE_TYPES
+                     else 'change', event)
+
+            wait = self.rng.uniform(0.5, 1.5) * self.pa_interval
+            heapq.heappush(upcoming,
+                           (timestamp + timedelta(seconds=wait), game,
+                            (pa + 1) % PLATE_APPEARANCES_PER_GAME))
+
+        stream.sort(key=lambda s: s[:2])
+        return [(timestamp, source, item)
+                for timestamp, _, source, item in stream]
+
+    def _capture(self, scrape_time: datetime) -> List[dict]:
+        batch = []
+        for player_id in sorted(self._dirty):
+            data = self._truth[player_id]
+            if data == self._last_recorded[player_id]:
+                # Chron only records a version when something changed
+                continue
+            self._last_recorded[player_id] = deepcopy(data)
+            batch.append({
+                'entityId': player_id,
+                'hash': self._hash(),
+                'validFrom': scrape_time +
+                timedelta(seconds=self.rng.uniform(0, 0.5)),
+                'data': deepcopy(data),
+            })
+        self._dirty.clear()
+        return batch
+
+    def _event(self, timestamp: datetime, event_type: int, game: int,
+               description: str, player_tags: List[str],
+               metadata: Optional[dict] = None) -> dict:
+        self.event_count += 1
+        return {'id': f"{self.event_count:08x}-0000-4000-8000-000000000000",
+                'created': timestamp, 'type': event_type,
+                'description': description, 'playerTags': player_tags,
+                'teamTags': [], 'gameTags': [self._game_ids[game]],
+                'metadata': metadata or {}}
+
+    def _plate_appearance(self, timestamp: datetime, game: int, pa: int) \
+            -> Iterator[dict]:
+        home, away = self.games[game]
+        if pa == 0:
+            self._games_started += 1
+            self._game_ids[game] = \
+                f"{self._games_started:08x}-0000-4000-9000-000000000000"
+            yield from self._game_start(timestamp, game, home + away)
+
+        lineup, fielders = (away, home) if (pa // 3) % 2 == 0 \
+            else (home, away)
+        if pa % 3 == 0:
+            yield self._event(timestamp, 2, game, "Top of the inning.", [])
+        # Each step of the plate appearance gets its own time, like in the
+        # real feed, so they can't be reordered among themselves
+        timestamp += EVENT_SPACING
+        batter = lineup[pa % len(lineup)]
+        data = self._truth[batter]
+        name = data['name']
+        yield self._event(timestamp, 12, game, f"{name} batting.", [batter])
+        timestamp += EVENT_SPACING
+
+        roll = self.rng.random()
+        for event_type, rate in OUTCOMES:
+            if roll < rate:
+                break
+            roll -= rate
+        else:
+            event_type = 5
+
+        self._dirty.add(batter)
+        if event_type in (9, 10):
+            data['consecutiveHits'] += 1
+            hit = self._event(timestamp, event_type, game,
+                              f"{name} hits a Single!" if event_type == 10
+                              else f"{name} hits a solo home run!", [batter])
+            yield hit
+            if event_type == 10 and 'COFFEE_RALLY' in data['permAttr']:
+                data['permAttr'].remove('COFFEE_RALLY')
+                yield self._event(timestamp, 107, game,
+                                  f"{name} used their Free Refill.", [batter],
+                                  {'mod': 'COFFEE_RALLY', 'type': 0,
+                                   'parent': {'id': hit['id'],
+                                              'type': hit['type']}})
+        elif event_type == 5:
+            yield self._event(timestamp, 5, game, f"{name} draws a walk.",
+                              [batter])
+        elif event_type == 6:
+            data['consecutiveHits'] = 0
+            yield self._event(timestamp, event_type, game,
+                              f"{name} strikes out looking.", [batter])
+        else:
+            data['consecutiveHits'] = 0
+            fielder = self.rng.choice(fielders)
+            out = 'flyout' if event_type == 7 else 'ground out'
+            yield self._event(timestamp, event_type, game,
+                              f"{name} hit a {out} to "
+                              f"{self._truth[fielder]['name']}.",
+                              [batter, fielder])
+
+        if pa == PLATE_APPEARANCES_PER_GAME - 1:
+            timestamp += EVENT_SPACING
+            yield self._event(timestamp, 11, game, "Game over.", [])
+
+    def _game_start(self, timestamp: datetime, game: int,
+                    players: List[str]) -> Iterator[dict]:
+        peanuts = self.rng.random() < 0.5
+        to_mod = 'OVERPERFORMING' if peanuts else 'UNDERPERFORMING'
+        from_mod = 'UNDERPERFORMING' if peanuts else 'OVERPERFORMING'
+        parent = {'id': f"{self.event_count:08x}-0000-4000-8000-ffffffffffff",
+                  'type': 92}
+        for player_id in players:
+            data = self._truth[player_id]
+            if 'SUPERYUMMY' not in data['permAttr'] or \
+                    to_mod in data['permAttr']:
+                continue
+
+            self._dirty.add(player_id)
+            sources = data['state'].setdefault('permModSources', {})
+            sources[to_mod] = ['SUPERYUMMY']
+            if from_mod in data['permAttr']:
+                data['permAttr'].remove(from_mod)
+                data['permAttr'].append(to_mod)
+                yield self._event(timestamp, 148, game,
+                                  f"{data['name']} is {to_mod.title()}.",
+                                  [player_id],
+                                  {'from': from_mod, 'to': to_mod, 'type': 0,
+                                   'parent': parent})
+            else:
+                data['permAttr'].append(to_mod)
+                yield self._event(timestamp, 146, game,
+                                  f"{data['name']} is {to_mod.title()}.",
+                                  [player_id],
+                                  {'mod': to_mod, 'type': 0,
+                                   'parent': parent})
@@ -0,0 +1,120 @@
+import random
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from statistics import mean, quantiles
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from ChangeSource import ChangeSource
+from Player import Player
+from PlayerHistory import PlayerHistory
+from Players import Change, TimestampSource, IncrementCounterEffect, \
+    ResetCounterEffect, ModEffect, ModDuration
+
+START_TIME = datetime(2021, 3, 1, 15, tzinfo=timezone.utc)
+PLAYERS = 100
+CHANGES_PER_PLAYER = 1000
+# How many changes each chron update accounts for, on average
+CHANGES_PER_CHRON_UPDATE = 4
+LOOKUPS = 2000
+KEYFRAME_INTERVALS = [8, 32, 128, 512]
+SEED = 0
+
+
+def synthetic_player(rng: random.Random, i: int) -> Player:
+    return Player({
+        'entityId': f"00000000-0000-0000-0000-{i:012d}",
+        'hash': f"{rng.getrandbits(128):032x}",
+        'validFrom': START_TIME,
+        'data': {'name': f"Player {i}", 'consecutiveHits': 0,
+                 'permAttr': [], 'seasAttr': [], 'weekAttr': [],
+                 'gameAttr': [], 'state': {}},
+    })
+
+
+def synthetic_change(rng: random.Random, player: Player,
+                     timestamp: datetime) -> Change:
+    if player.data['gameAttr']:
+        effect = ModEffect(from_mod=player.data['gameAttr'][0], to_mod=None,
+                           type=ModDuration.GAME)
+        source = ChangeSource.SUPERYUMMY
+    elif rng.random() < 0.05:
+        effect = ModEffect(from_mod=None, to_mod='OVERPERFORMING',
+                           type=ModDuration.GAME)
+        source = ChangeSource.SUPERYUMMY
+    elif rng.random() < 0.3:
+        effect = IncrementCounterEffect(('consecutiveHits',))
+        source = ChangeSource.HIT
+    else:
+        effect = ResetCounterEffect(('consecutiveHits',))
+        source = ChangeSource.NON_HIT
+    return Change(source=source, timestamp=timestamp,
+                  timestamp_source=TimestampSource.FEED, effects=[effect])
+
+
+def chron_update(rng: random.Random, player: Player,
+                 timestamp: datetime) -> dict:
+    # Chron sees the change a little after it happens
+    return {'entityId': player.entityId,
+            'hash': f"{rng.getrandbits(128):032x}",
+            'validFrom': timestamp + timedelta(seconds=30),
+            'data': deepcopy(player.data)}
+
+
+def build_history(keyframe_interval: int) \
+        -> Tuple[PlayerHistory, Dict[str, List[tuple]]]:
+    rng = random.Random(SEED)
+    history = PlayerHistory(START_TIME, keyframe_interval)
+    truth: Dict[str, List[tuple]] = {}
+
+    for i in range(PLAYERS):
+        player = synthetic_player(rng, i)
+        history.add_player(player)
+        truth[player.entityId] = []
+
+        timestamp = START_TIME
+        pending = []
+        for _ in range(CHANGES_PER_PLAYER):
+            timestamp += timedelta(seconds=rng.randrange(5, 600))
+            change = synthetic_change(rng, player, timestamp)
+            change.apply(player)
+            pending.append(change)
+            truth[player.entityId].append((timestamp, deepcopy(player.data)))
+
+            if rng.random() < 1 / CHANGES_PER_CHRON_UPDATE:
+                history.record(chron_update(rng, player, timestamp),
+                               pending)
+                pending = []
+
+        if pending:
+            history.record(chron_update(rng, player, timestamp), pending)
+
+    return history, truth
+
+
+def main():
+    print(f"{PLAYERS} players, {CHANGES_PER_PLAYER} changes each")
+    print(f"{'interval':>8} {'keyframes':>10} {'mean us':>9} {'p50 us':>9} "
+          f"{'p99 us':>9}")
+    for keyframe_interval in KEYFRAME_INTERVALS:
+        history, truth = build_history(keyframe_interval)
+        rng = random.Random(SEED)
+        player_ids = list(truth.keys())
+
+        latencies = []
+        for _ in range(LOOKUPS):
+            player_id = rng.choice(player_ids)
+            timestamp, expected = rng.choice(truth[player_id])
+            start = perf_counter()
+            player = history.player_at(player_id, timestamp)
+            latencies.append((perf_counter() - start) * 1e6)
+            assert player.data == expected
+
+        percentiles = quantiles(latencies, n=100)
+        print(f"{keyframe_interval:>8} {history.keyframe_count():>10} "
+              f"{mean(latencies):>9.1f} {percentiles[49]:>9.1f} "
+              f"{percentiles[98]:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
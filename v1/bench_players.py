@@ -0,0 +1,172 @@
+import argparse
+import os
+import random
+import tempfile
+from datetime import timedelta
+from statistics import mean, quantiles
+from time import perf_counter
+from typing import List
+
+from NameResolver import NameResolver
+from Players import Players, Verification
+from ReorderBuffer import CHRON_SOURCE, ReorderBuffer
+from StateStore import SqliteStore
+from SyntheticLeague import SEED, START_TIME, StreamItem, SyntheticLeague
+
+PLAYER_COUNTS = [180, 720, 2880]
+# Average seconds between plate appearances in each game
+PA_INTERVALS = [10.0, 5.0, 2.5]
+MINUTES = 30
+
+
+def arrive_out_of_order(stream: List[StreamItem], disorder: float) \
+        -> List[StreamItem]:
+    # Every item shows up some time up to `disorder` seconds after it
+    # happened, like feed pages and scrapes coming back at different speeds
+    rng = random.Random(SEED)
+    arrivals = [(timestamp + timedelta(seconds=rng.uniform(0, disorder)), i)
+                for i, (timestamp, _, _) in enumerate(stream)]
+    return [stream[i] for _, i in sorted(arrivals)]
+
+
+def run(player_count: int, pa_interval: float, minutes: float,
+        disorder: float, batch_size: int = 0,
+        verification: Verification = Verification.ALWAYS,
+        store_cache: int = 0) -> dict:
+    league = SyntheticLeague(player_count, pa_interval)
+    stream = league.stream(minutes)
+    buffer = ReorderBuffer(timedelta(seconds=disorder))
+    if disorder > 0:
+        stream = arrive_out_of_order(stream, disorder)
+    # No roster intervals, so every synthetic player is always rostered
+    stores = {}
+    if store_cache:
+        store_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(store_dir.name, 'players.sqlite')
+        stores = {'player_store': SqliteStore(path, 'players', store_cache),
+                  'change_store': SqliteStore(path, 'changes', store_cache,
+                                              default_factory=list)}
+    players = Players(START_TIME, initial_players=league.initial_players(),
+                      names=NameResolver(), verification=verification,
+                      **stores)
+
+    event_latencies, update_latencies, pending_lengths = [], [], []
+    events, updates, associated, max_games = 0, 0, 0, 0
+    event_seconds, update_seconds = 0., 0.
+    batch: List[dict] = []
+
+    def apply_batch():
+        nonlocal event_seconds, events, max_games
+        if not batch:
+            return
+        start = perf_counter()
+        players.apply_events(batch)
+        elapsed = perf_counter() - start
+        max_games = max(max_games, len(players.games))
+        event_seconds += elapsed
+        events += len(batch)
+        # Every event in the batch is counted as taking the batch's average
+        event_latencies.extend([elapsed / len(batch) * 1e6] * len(batch))
+        batch.clear()
+
+    # Players logs each event at DEBUG, which is left off here as it is in
+    # a real run
+    for _, source, item in buffer.reorder(stream):
+        if source == CHRON_SOURCE:
+            apply_batch()
+            start = perf_counter()
+            for _, changes in players.associate_chron_updates(item):
+                associated += len(changes)
+            elapsed = perf_counter() - start
+            update_seconds += elapsed
+            updates += len(item)
+            update_latencies.append(elapsed / len(item) * 1e6)
+            pending_lengths.extend(players.pending_counts())
+        elif batch_size:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                apply_batch()
+        else:
+            start = perf_counter()
+            if source == 'game_state':
+                players.games.apply_event(item)
+            else:
+                players.apply_event(item)
+            elapsed = perf_counter() - start
+            max_games = max(max_games, len(players.games))
+            event_seconds += elapsed
+            events += 1
+            event_latencies.append(elapsed * 1e6)
+    apply_batch()
+
+    event_percentiles = quantiles(event_latencies, n=100)
+    update_percentiles = quantiles(update_latencies, n=100)
+    return {
+        'players': player_count,
+        'pa_interval': pa_interval,
+        'events': events,
+        'events_per_second': events / event_seconds,
+        'event_p50_us': event_percentiles[49],
+        'event_p99_us': event_percentiles[98],
+        'chron_updates': updates,
+        'chron_updates_per_second': updates / update_seconds,
+        'chron_update_p50_us': update_percentiles[49],
+        'chron_update_p99_us': update_percentiles[98],
+        'changes_associated': associated,
+        'mean_pending': mean(pending_lengths) if pending_lengths else 0,
+        'max_pending': max(pending_lengths, default=0),
+        'max_games': max_games,
+        'late': buffer.late,
+        'max_buffered': buffer.max_buffered,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark Players on synthetic feed and chron streams")
+    parser.add_argument('--players', type=int, nargs='+',
+                        default=PLAYER_COUNTS)
+    parser.add_argument('--pa-interval', type=float, nargs='+',
+                        default=PA_INTERVALS,
+                        help="Average seconds between plate appearances")
+    parser.add_argument('--minutes', type=float, default=MINUTES,
+                        help="Length of the synthetic stream")
+    parser.add_argument('--disorder', type=float, default=0,
+                        help="Deliver items up to this many seconds late, "
+                             "and reorder them with that much lateness")
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help="Give Players feed events through apply_events "
+                             "in batches of up to this many, rather than "
+                             "one at a time through apply_event")
+    parser.add_argument('--verify', default=Verification.ALWAYS.value,
+                        choices=[v.value for v in Verification],
+                        help="How Players checks each association")
+    parser.add_argument('--store-cache', type=int, default=0,
+                        help="Keep players and pending changes in SQLite, "
+                             "with this many of each in memory")
+    args = parser.parse_args()
+
+    print(f"{'players':>7} {'pa int':>6} {'events':>7} {'ev/s':>8} "
+          f"{'ev p50':>7} {'ev p99':>7} {'updates':>7} {'upd/s':>8} "
+          f"{'upd p50':>8} {'upd p99':>8} {'pending':>7} {'max':>4} "
+          f"{'games':>5} {'buffered':>8} {'late':>4}")
+    for player_count in args.players:
+        for pa_interval in args.pa_interval:
+            result = run(player_count, pa_interval, args.minutes,
+                         args.disorder, args.batch_size,
+                         Verification(args.verify), args.store_cache)
+            print(f"{result['players']:>7} {result['pa_interval']:>6.1f} "
+                  f"{result['events']:>7} {result['events_per_second']:>8.0f} "
+                  f"{result['event_p50_us']:>7.1f} "
+                  f"{result['event_p99_us']:>7.1f} "
+                  f"{result['chron_updates']:>7} "
+                  f"{result['chron_updates_per_second']:>8.0f} "
+                  f"{result['chron_update_p50_us']:>8.1f} "
+                  f"{result['chron_update_p99_us']:>8.1f} "
+                  f"{result['mean_pending']:>7.2f} "
+                  f"{result['max_pending']:>4} {result['max_games']:>5} "
+                  f"{result['max_buffered']:>8} {result['late']:>4}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import random
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Callable, List
+
+from dateutil.parser import isoparse
+
+from timestamps import parse_timestamp
+
+START_TIME = datetime(2021, 3, 1, 15, tzinfo=timezone.utc)
+# A game tick's worth of feed events share a created time, like a chron
+# batch shares a validFrom
+BATCHES = 5000
+MAX_BATCH_SIZE = 20
+SEED = 0
+
+
+def format_chron(timestamp: datetime) -> str:
+    # Chronicler trims trailing zeros from the fraction, and leaves it off
+    # if it's all zeros
+    text = timestamp.strftime('%Y-%m-%dT%H:%M:%S.%f').rstrip('0')
+    return text.rstrip('.') + 'Z'
+
+
+def format_feed(timestamp: datetime) -> str:
+    return timestamp.isoformat(timespec='milliseconds')
+
+
+def synthetic_timestamps(format_time: Callable[[datetime], str]) -> List[str]:
+    rng = random.Random(SEED)
+    timestamp = START_TIME
+    timestamps = []
+    for _ in range(BATCHES):
+        timestamp += timedelta(microseconds=rng.randrange(1, 10_000_000))
+        timestamps.extend([format_time(timestamp)] *
+                          rng.randrange(1, MAX_BATCH_SIZE + 1))
+    return timestamps
+
+
+def time_parser(parse: Callable[[str], datetime], timestamps: List[str]) \
+        -> float:
+    # Microseconds per timestamp
+    start = perf_counter()
+    for text in timestamps:
+        parse(text)
+    return (perf_counter() - start) * 1e6 / len(timestamps)
+
+
+def main():
+    parsers = [
+        ('isoparse', isoparse),
+        ('uncached', parse_timestamp.__wrapped__),
+        ('cached', parse_timestamp),
+    ]
+    print(f"{'source':>6} {'count':>7} " +
+          " ".join(f"{name + ' us':>11}" for name, _ in parsers))
+    for source, format_time in [('chron', format_chron),
+                                ('feed', format_feed)]:
+        timestamps = synthetic_timestamps(format_time)
+        for text in timestamps[:1000]:
+            assert parse_timestamp(text) == isoparse(text)
+        parse_timestamp.cache_clear()
+
+        print(f"{source:>6} {len(timestamps):>7} " +
+              " ".join(f"{time_parser(parse, timestamps):>11.2f}"
+                       for _, parse in parsers))
+
+
+if __name__ == '__main__':
+    main()
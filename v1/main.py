@@ -1,15 +1,34 @@
-from datetime import datetime, timedelta
-from heapq import merge
-from typing import Iterator, List, Tuple, Any
+import argparse
+import logging
+import os
+import pickle
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Any
 
 from backports.zoneinfo import ZoneInfo
 
 import requests_cache
-from blaseball_mike import chronicler, eventually
-from blaseball_mike.session import _SESSIONS_BY_EXPIRY
-from dateutil.parser import isoparse
+from blaseball_mike import eventually
+from blaseball_mike.chronicler import v2 as chronicler_v2
+from blaseball_mike.session import _SESSIONS_BY_EXPIRY, \
+    session as mike_session
 
-from v1.Players import Players
+import chron_archive
+import pipeline_log
+import pipeline_metrics
+from change_sink import ChangeRecord, ChangeSink, join_keys
+from id_intern import ids
+from pipeline_metrics import PipelineMetrics
+from timestamps import parse_timestamp
+from v1.ChronStream import get_versions
+from v1.Players import Players, Change, Verification
+from v1.ReorderBuffer import CHRON_SOURCE, ReorderBuffer
+from v1.Scheduler import Scheduler
+from v1.StateStore import CACHE_SIZE, SqliteStore
+
+log = logging.getLogger(__name__)
 
 session = requests_cache.CachedSession("blaseball-player-changes",
                                        backend="sqlite", expire_after=None)
@@ -18,56 +37,359 @@ _SESSIONS_BY_EXPIRY[None] = session
 EXPANSION_ERA_START = datetime(year=2021, month=3, day=1, hour=10,
                                tzinfo=ZoneInfo('US/Eastern'))
 ONE_SECOND = timedelta(seconds=1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+# How far out of order feed events and chron batches can arrive and still be
+# applied in order
+ALLOWED_LATENESS = timedelta(seconds=30)
+
+CHANGES_DB_PATH = "changes.sqlite"
+STATE_PATH = "v1-follow-state.pickle"
+# Seconds between polls once follow mode has caught up
+POLL_INTERVAL = 10
+
+# How often --verify sampled does a full check
+VERIFY_EVERY = 100
+# Most feed events Players is given at once
+EVENT_BATCH_SIZE = 500
+
+FEED_QUERIES = {
+    'change': {'category': '1'},  # Changes
+    'hit_or_lack_thereof': {'type': '6_or_7_or_8_or_9_or_10'},
+    # Half innings, pitcher changes, walks, game ends and batters up, for
+    # knowing who's batting
+    'game_state': {'type': '2_or_3_or_5_or_11_or_12'},
+}
+
+
+@dataclass
+class Cursor:
+    """
+    Where the next poll of one source starts: the latest time read from it,
+    and the ids of everything read with exactly that time. Chronicler's and
+    Eventually's `after` is exclusive, and an item can turn up late with the
+    same time as ones already read, so polls ask from just before `time`
+    and skip the ones already read.
+    """
+    time: datetime
+    seen: Set[str] = field(default_factory=set)
+
+    @property
+    def after(self) -> datetime:
+        # Both sources' timestamps go down to the microsecond
+        return self.time - ONE_MICROSECOND
+
+    def advance(self, time: datetime, item_id: str) -> bool:
+        # False if the item was already read
+        if time < self.time or (time == self.time and item_id in self.seen):
+            return False
+        if time > self.time:
+            self.time = time
+            self.seen = set()
+        self.seen.add(item_id)
+        return True
+
+
+@dataclass
+class PlayerOptions:
+    """How Players is run, as opposed to what it has seen"""
+    verification: Verification = Verification.ALWAYS
+    verify_every: int = VERIFY_EVERY
+    # SQLite file to keep player documents and pending changes in, with
+    # `store_cache` of each in memory. Everything is in memory if None.
+    store_path: Optional[str] = None
+    store_cache: int = CACHE_SIZE
 
+    def players(self, start_time: datetime) -> Players:
+        # For a fresh run. A saved FollowState reopens its stores as they
+        # were when it's loaded instead.
+        stores = {}
+        if self.store_path is not None:
+            stores = {
+                'player_store': SqliteStore(self.store_path, 'players',
+                                            self.store_cache),
+                'change_store': SqliteStore(self.store_path, 'changes',
+                                            self.store_cache,
+                                            default_factory=list),
+            }
+            # Whatever a previous run left would be taken for players this
+            # run has already seen
+            for store in stores.values():
+                store.clear()
+        return Players(start_time, verification=self.verification,
+                       verify_every=self.verify_every, **stores)
 
-def get_chron_batched() -> Iterator[Tuple[datetime, str, List[dict]]]:
+
+@dataclass
+class FollowState:
+    """
+    Everything follow mode needs to pick up where it left off: the players
+    and their pending changes, anything still held in the reorder buffer,
+    and a cursor per source.
+    """
+    players: Players
+    buffer: ReorderBuffer
+    cursors: Dict[str, Cursor]
+    # Players is keyed on interned ids, so the numbering is saved with it
+    uuids: List[str] = field(default_factory=list)
+
+    @classmethod
+    def start(cls, options: PlayerOptions,
+              start_time: datetime = EXPANSION_ERA_START) -> 'FollowState':
+        return cls(options.players(start_time),
+                   ReorderBuffer(ALLOWED_LATENESS),
+                   {source: Cursor(start_time)
+                    for source in [CHRON_SOURCE, *FEED_QUERIES]})
+
+    @classmethod
+    def load(cls, path: str) -> Optional['FollowState']:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        ids.restore(state.uuids)
+        return state
+
+    def save(self, path: str) -> None:
+        # Written aside and moved into place, so a crash mid-save leaves the
+        # previous state intact
+        self.uuids = ids.uuids
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+
+def get_chron_versions(cursor: Cursor, cache_time: Optional[int]) \
+        -> Iterator[dict]:
+    # TIMESTAMP_FORMAT ends in Z, so `after` has to be in UTC
+    for chron_entry in get_versions(
+            "player", after=cursor.after.astimezone(timezone.utc),
+            order='asc', cache_time=cache_time):
+        chron_entry['validFrom'] = parse_timestamp(chron_entry['validFrom'])
+        if cursor.advance(chron_entry['validFrom'],
+                          chron_entry['entityId'] + chron_entry['hash']):
+            yield chron_entry
+
+
+def get_chron_batched(versions: Iterable[dict]) \
+        -> Iterator[Tuple[datetime, List[dict]]]:
     current_batch = []
     current_batch_date = None
-    for chron_entry in chronicler.get_versions("player",
-                                               after=EXPANSION_ERA_START,
-                                               order='asc',
-                                               cache_time=None):
-        chron_entry['validFrom'] = isoparse(chron_entry['validFrom'])
+    for chron_entry in versions:
         if current_batch_date is None:
             current_batch_date = chron_entry['validFrom']
         elif chron_entry['validFrom'] - current_batch_date > ONE_SECOND:
-            yield current_batch_date, 'chron_updates', current_batch
+            yield current_batch_date, current_batch
             current_batch = []
             current_batch_date = chron_entry['validFrom']
-        print("Batching chron entry for", chron_entry['data']['name'])
+        log.debug("Batching chron entry for %s", chron_entry['data']['name'],
+                  extra={'entity_id': chron_entry['entityId']})
         current_batch.append(chron_entry)
+    if current_batch:
+        yield current_batch_date, current_batch
 
 
-def get_feed(query, query_name) -> Iterator[Tuple[datetime, dict]]:
+def get_feed(query, cursor: Cursor, cache_time: Optional[int]) \
+        -> Iterator[Tuple[datetime, dict]]:
     q = {
         'expand_parent': 'true',
-        'after': EXPANSION_ERA_START.isoformat(),
+        'after': cursor.after.isoformat(),
         'sortorder': '{created}',
         **query
     }
-    for event in eventually.search(cache_time=None, limit=-1, query=q):
-        event['created'] = isoparse(event['created'])
-        yield event['created'], query_name, event
+    for event in eventually.search(cache_time=cache_time, limit=-1, query=q):
+        event['created'] = parse_timestamp(event['created'])
+        if cursor.advance(event['created'], event['id']):
+            yield event['created'], event
 
 
-def get_associations():
-    players = Players(EXPANSION_ERA_START)
-
-    iterators = [
-        get_chron_batched(),
-        get_feed({'category': '1'}, 'change'),  # Changes
-        get_feed({'type': '6_or_7_or_8_or_9_or_10'}, 'hit_or_lack_thereof'),
-    ]
-    for _, source, item in merge(*iterators):
-        if source == 'chron_updates':
+def associate(players: Players, stream: Iterable[Tuple[datetime, str, Any]]) \
+        -> Iterator[Tuple[dict, List[Change]]]:
+    # Feed events are applied in batches, which only have to be cut short
+    # when a chron batch needs every event before it applied
+    events = []
+    for _, source, item in stream:
+        if source == CHRON_SOURCE:
+            players.apply_events(events)
+            events = []
             yield from players.associate_chron_updates(item)
         else:
-            players.apply_event(item)
+            events.append(item)
+            if len(events) >= EVENT_BATCH_SIZE:
+                players.apply_events(events)
+                events = []
+    players.apply_events(events)
+
+
+def observed(stream: Iterable[Tuple[datetime, str, Any]],
+             metrics: PipelineMetrics) -> Iterator[Tuple[datetime, str, Any]]:
+    for timestamp, source, item in stream:
+        metrics.observe(source, timestamp,
+                        len(item) if source == CHRON_SOURCE else 1)
+        yield timestamp, source, item
+
+
+def watch_state(metrics: PipelineMetrics, state: FollowState) -> None:
+    players = state.players
+    metrics.add_gauge('pending_changes',
+                      lambda: sum(players.pending_counts()))
+    metrics.add_gauge('pending_changes_max_per_player',
+                      lambda: max(players.pending_counts(), default=0))
+    metrics.add_gauge('players_with_pending_changes',
+                      lambda: len(players.pending_counts()))
+    metrics.add_gauge('games_in_progress', lambda: len(players.games))
+    metrics.add_gauge('reorder_buffered', lambda: len(state.buffer))
+
+
+def poll(state: FollowState, cache_time: Optional[int],
+         metrics: Optional[PipelineMetrics] = None) \
+        -> Iterator[Tuple[dict, List[Change]]]:
+    """
+    Reads everything each source has past its cursor and pushes it through
+    the reorder buffer into Players. Items the watermark hasn't reached yet
+    stay in the buffer for the next poll.
+    """
+    scheduler = Scheduler()
+    for query_name, query in FEED_QUERIES.items():
+        scheduler.add_source(query_name, get_feed(
+            query, state.cursors[query_name], cache_time))
+    # After feed events with the same time, like in the reorder buffer
+    scheduler.add_source(CHRON_SOURCE, get_chron_batched(get_chron_versions(
+        state.cursors[CHRON_SOURCE], cache_time)), priority=1)
+
+    stream = iter(scheduler)
+    if metrics is not None:
+        stream = observed(stream, metrics)
+    yield from associate(state.players, state.buffer.push_all(stream))
+
+    for name, stats in scheduler.stats().items():
+        log.info("Read %d from %s in %.1fs", stats.items, name,
+                 stats.seconds, extra={'source': name, 'items': stats.items,
+                                       'seconds': stats.seconds})
+
+
+def get_associations(metrics: Optional[PipelineMetrics] = None,
+                     options: PlayerOptions = PlayerOptions()):
+    state = FollowState.start(options)
+    if metrics is not None:
+        watch_state(metrics, state)
+    yield from poll(state, cache_time=None, metrics=metrics)
+    yield from associate(state.players, state.buffer.flush())
+
+
+def follow(sink: ChangeSink, state_path: str, poll_interval: float,
+           metrics: PipelineMetrics,
+           options: PlayerOptions = PlayerOptions()):
+    """
+    Catches up from the saved state (or the start of the expansion era), then
+    keeps polling for new chron versions and feed events. The state is saved
+    after every poll, once the associations it made are committed, so a
+    restart resumes from the last completed poll.
+    """
+    state = FollowState.load(state_path)
+    if state is None:
+        state = FollowState.start(options)
+    else:
+        # Whatever the saved state was run with, this run's settings win.
+        # Where the players are stored can't change.
+        state.players.verification = options.verification
+        state.players.verify_every = options.verify_every
+    watch_state(metrics, state)
+    while True:
+        # Never cached, since the newest page of any source can still grow
+        for chron_update, changes in poll(state, cache_time=0,
+                                          metrics=metrics):
+            sink.write(association_records(chron_update, changes))
+        sink.sync()
+        state.save(state_path)
+        pipeline_log.flush()
+        metrics.tick()
+        time.sleep(poll_interval)
+
+
+def association_records(chron_update: dict, changes: List[Change]) \
+        -> Iterator[ChangeRecord]:
+    valid_from = chron_update['validFrom'].isoformat()
+    for change in changes:
+        yield ChangeRecord(pipeline='v1',
+                           entity_id=chron_update['entityId'],
+                           valid_from=valid_from,
+                           source_type=change.source.name,
+                           keys_changed=join_keys(change.keys_changed()),
+                           perceived_at=change.timestamp.isoformat())
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is less than 1")
+    return number
 
 
 def main():
-    for association in get_associations():
-        pass
+    parser = argparse.ArgumentParser(
+        description="Associate chron player versions with the feed events "
+                    "that caused them")
+    parser.add_argument('--follow', action='store_true',
+                        help="After catching up, keep polling for new data")
+    parser.add_argument('--state', default=STATE_PATH,
+                        help="Where follow mode saves its progress and "
+                             "resumes from")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help="Seconds between polls in follow mode")
+    parser.add_argument('--changes-db', default=CHANGES_DB_PATH)
+    parser.add_argument('--chronicler-url', default=chronicler_v2.BASE_URL_V2,
+                        help="Chronicler v2 base URL, e.g. a local stand-in")
+    parser.add_argument('--eventually-url', default=eventually.BASE_URL,
+                        help="Eventually v2 base URL, e.g. a local stand-in")
+    parser.add_argument('--archive', default=chron_archive.ARCHIVE_PATH,
+                        help="Where to archive Chronicler versions and "
+                             "entities in place of the requests cache, or "
+                             "'' to use the requests cache. In --follow "
+                             "mode only the starting players are archived, "
+                             "since polls always go to Chronicler.")
+    parser.add_argument('--verify', default=Verification.ALWAYS.value,
+                        choices=[v.value for v in Verification],
+                        help="How thoroughly to check each association. "
+                             "sampled does a full check every "
+                             "--verify-every updates, hash only compares "
+                             "the keys the changes touched.")
+    parser.add_argument('--verify-every', type=positive_int,
+                        default=VERIFY_EVERY)
+    parser.add_argument('--player-store',
+                        help="SQLite file to keep players and pending "
+                             "changes in, rather than memory")
+    parser.add_argument('--player-cache', type=int, default=CACHE_SIZE,
+                        help="Players, and players' pending changes, to "
+                             "keep in memory with --player-store")
+    pipeline_log.add_arguments(parser)
+    pipeline_metrics.add_arguments(parser, 'v1')
+    args = parser.parse_args()
+
+    pipeline_log.configure_from_args(args)
+    metrics = pipeline_metrics.from_args(args, 'v1')
+    metrics.watch_session(session)
+    metrics.watch_session(mike_session(0))
+
+    chronicler_v2.BASE_URL_V2 = args.chronicler_url
+    eventually.BASE_URL = args.eventually_url
+    if args.archive:
+        chron_archive.archive = chron_archive.ChronArchive(args.archive)
+
+    options = PlayerOptions(Verification(args.verify), args.verify_every,
+                            args.player_store, args.player_cache)
+
+    try:
+        with ChangeSink(args.changes_db) as sink:
+            if args.follow:
+                follow(sink, args.state, args.poll_interval, metrics, options)
+            else:
+                for chron_update, changes in get_associations(metrics,
+                                                              options):
+                    sink.write(association_records(chron_update, changes))
+    finally:
+        metrics.write()
+        if chron_archive.archive is not None:
+            chron_archive.archive.close()
 
 
 if __name__ == '__main__':
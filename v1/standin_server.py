@@ -0,0 +1,161 @@
+import argparse
+import json
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from blaseball_mike.session import TIMESTAMP_FORMAT
+from dateutil.parser import isoparse
+
+from ReorderBuffer import CHRON_SOURCE
+from SyntheticLeague import START_TIME, SyntheticLeague
+
+PORT = 8765
+PLAYERS = 180
+# Average seconds between plate appearances in each game
+PA_INTERVAL = 5.0
+MINUTES = 60
+# Synthetic seconds that pass per real second
+SPEED = 10.0
+# Feed events main.get_feed's category 1 query asks for
+CHANGE_TYPES = {106, 107, 146, 147, 148}
+
+
+def _format_time(time: datetime) -> str:
+    return time.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def _parse_time(value: str) -> datetime:
+    time = isoparse(value)
+    return time if time.tzinfo is not None else \
+        time.replace(tzinfo=timezone.utc)
+
+
+class StandIn:
+    """
+    A SyntheticLeague served as if it were happening now. The league's whole
+    stream is generated up front, starting from when the server starts, and
+    each chron version and feed event only shows up once the synthetic clock
+    passes its time, so clients polling it see data appended over time.
+    """
+
+    def __init__(self, league: SyntheticLeague, minutes: float, speed: float):
+        self.speed = speed
+        self.entities = [dict(entry, validFrom=_format_time(START_TIME))
+                         for entry in league.initial_players()]
+
+        versions, events = [], []
+        for _, source, item in league.stream(minutes):
+            if source == CHRON_SOURCE:
+                versions.extend(item)
+            else:
+                events.append(item)
+        versions.sort(key=lambda version: version['validFrom'])
+        events.sort(key=lambda event: event['created'])
+
+        self.version_times = [version['validFrom'] for version in versions]
+        self.versions = [dict(version, validFrom=_format_time(time))
+                         for version, time in zip(versions,
+                                                  self.version_times)]
+        self.event_times = [event['created'] for event in events]
+        self.events = [dict(event, created=_format_time(time),
+                            category=1 if event['type'] in CHANGE_TYPES
+                            else 2)
+                       for event, time in zip(events, self.event_times)]
+        self.started = monotonic()
+
+    def now(self) -> datetime:
+        return START_TIME + \
+            timedelta(seconds=(monotonic() - self.started) * self.speed)
+
+    def _visible(self, times: List[datetime], after: Optional[str]) \
+            -> Tuple[int, int]:
+        # Range of indices after `after` that have already happened.
+        # Exclusive, like Chronicler and Eventually.
+        start = bisect_right(times, _parse_time(after)) if after else 0
+        return start, bisect_right(times, self.now())
+
+    def get_versions(self, params: dict) -> dict:
+        start, end = self._visible(self.version_times, params.get('after'))
+        offset = start + int(params.get('page', 0))
+        count = int(params.get('count', 1000))
+        items = self.versions[offset:min(offset + count, end)]
+        next_page = offset - start + len(items) \
+            if offset + len(items) < end else None
+        return {'nextPage': None if next_page is None else str(next_page),
+                'items': items}
+
+    def get_events(self, params: dict) -> list:
+        start, end = self._visible(self.event_times, params.get('after'))
+        if 'type' in params:
+            types = {int(t) for t in params['type'].split('_or_')}
+        elif params.get('category') == '1':
+            types = CHANGE_TYPES
+        else:
+            types = None
+        matching = [event for event in self.events[start:end]
+                    if types is None or event['type'] in types]
+        offset = int(params.get('offset', 0))
+        return matching[offset:offset + int(params.get('limit', 100))]
+
+
+def make_handler(stand_in: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1]
+                      for key, values in parse_qs(url.query).items()}
+            if url.path == '/chronicler/v2/entities':
+                body = {'nextPage': None, 'items': stand_in.entities}
+            elif url.path == '/chronicler/v2/versions':
+                body = stand_in.get_versions(params)
+            elif url.path == '/eventually/v2/events':
+                body = stand_in.get_events(params)
+            else:
+                self.send_error(404)
+                return
+
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a synthetic league through stand-ins for the "
+                    "Chronicler and Eventually endpoints main.py uses")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--players', type=int, default=PLAYERS)
+    parser.add_argument('--pa-interval', type=float, default=PA_INTERVAL,
+                        help="Average seconds between plate appearances")
+    parser.add_argument('--minutes', type=float, default=MINUTES,
+                        help="Length of the synthetic stream")
+    parser.add_argument('--speed', type=float, default=SPEED,
+                        help="Synthetic seconds that pass per real second")
+    args = parser.parse_args()
+
+    stand_in = StandIn(SyntheticLeague(args.players, args.pa_interval),
+                       args.minutes, args.speed)
+    server = ThreadingHTTPServer(('localhost', args.port),
+                                 make_handler(stand_in))
+    print(f"Serving {len(stand_in.versions)} chron versions and "
+          f"{len(stand_in.events)} feed events over "
+          f"{args.minutes * 60 / args.speed:.0f}s. Run main.py with\n"
+          f"  --chronicler-url http://localhost:{args.port}/chronicler/v2 "
+          f"--eventually-url http://localhost:{args.port}/eventually/v2")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()